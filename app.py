@@ -4,19 +4,29 @@
 # Save as: app.py
 # Run: python -m streamlit run app.py
 
+import time
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
-import firebase_admin
-from firebase_admin import credentials, firestore
-from datetime import datetime
+from order_export import DEFAULT_OUTLET, FORMATS, export_orders, outlet_root
+from datetime import datetime, timedelta, timezone
+import copy
+import functools
+import hashlib
+import importlib
+import itertools
+import logging
+import os
+import random
+import re
+import string
+import tempfile
+import threading
 import urllib.parse
-@st.cache_resource
-def init_firebase():
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(dict(st.secrets["firebase"]))
-        firebase_admin.initialize_app(cred)
-    return firestore.client()
-
-db = init_firebase()
+import uuid
+from category_model import CategoryModel, ModelTrainer
+from instrumentation import InstrumentedClient, background_stats, current_stats, enable_logging, log_rerun, start_rerun
+from outbox import Outbox, OutboxWorker
 
 # Page config
 st.set_page_config(
@@ -75,25 +85,117 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ============================================
-# FIREBASE SETUP
+# STORAGE SETUP
 # ============================================
 
+def storage_config():
+    """Return (backend, sqlite_path) from the environment or st.secrets.
+    
+    ORDERFLOW_STORAGE / ORDERFLOW_SQLITE_PATH take precedence over a
+    [storage] table with backend / sqlite_path keys in secrets.toml, so
+    offline runs need no secrets file at all. The default is Firestore.
+    """
+    from docstore import BACKENDS
+    
+    backend = os.environ.get("ORDERFLOW_STORAGE")
+    sqlite_path = os.environ.get("ORDERFLOW_SQLITE_PATH")
+    if backend is None:
+        storage = st.secrets.get("storage", {})
+        backend = storage.get("backend", "firestore")
+        sqlite_path = sqlite_path or storage.get("sqlite_path")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    return backend, sqlite_path or "orderflow.db"
+
 @st.cache_resource
 def init_firebase():
-    try:
-        firebase_admin.get_app()
-    except ValueError:
-        
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(dict(st.secrets["firebase"]))
         firebase_admin.initialize_app(cred)
     return firestore.client()
 
-db = init_firebase()
+@st.cache_resource
+def init_storage():
+    backend, sqlite_path = storage_config()
+    if backend == "firestore":
+        return init_firebase()
+    from docstore import create_store
+    
+    return create_store(backend, sqlite_path)
+
+def outbox_path():
+    """SQLite file for the offline write queue, or None to write to storage directly.
+    
+    Only Firestore gets a queue; the local backends cannot lose their
+    connection. ORDERFLOW_OUTBOX_PATH (or outbox_path under [storage] in
+    secrets) moves the file, and an empty value turns the queue off.
+    """
+    if storage_config()[0] != "firestore":
+        return None
+    path = os.environ.get("ORDERFLOW_OUTBOX_PATH")
+    if path is None:
+        path = st.secrets.get("storage", {}).get("outbox_path", "orderflow_outbox.db")
+    return path or None
+
+@st.cache_resource
+def get_outbox():
+    path = outbox_path()
+    return Outbox(path) if path else None
+
+class LazyResource:
+    """Stand-in that builds the real object on first attribute access.
+    
+    Lets module-level names like db and draft_manager exist without
+    touching storage, so screens that need no data (login) render
+    without paying for the client.
+    """
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+    
+    def __getattr__(self, name):
+        if self._target is None:
+            self._target = self._factory()
+        return getattr(self._target, name)
+
+# Sentinels, query constants and error types. google.cloud.firestore_v1 and
+# the stores in docstore take about half a second to import, so both are
+# loaded on first data access rather than before the login screen.
+firestore = LazyResource(lambda: importlib.import_module("google.cloud.firestore_v1"))
+gcp_exceptions = LazyResource(lambda: importlib.import_module("google.api_core.exceptions"))
+
+# Every storage call below is counted and timed against this rerun's stats
+start_rerun(started=SCRIPT_STARTED)
+if os.environ.get("ORDERFLOW_DATA_LOG"):
+    enable_logging()
+logger = logging.getLogger("orderflow.data")
+db = LazyResource(lambda: InstrumentedClient(init_storage()))
+
+# ============================================
+# OUTLETS
+# ============================================
+
+# Each outlet (kitchen) has its own draft, order history, vendors and
+# keywords. The default outlet keeps the original top-level paths so
+# existing data stays where it is; the others live under outlets/{id}/
+# (DEFAULT_OUTLET and outlet_root come from order_export, whose CLI needs them too).
+OUTLETS = list(dict.fromkeys(
+    [DEFAULT_OUTLET] + [name.strip() for name in os.environ.get("ORDERFLOW_OUTLETS", "").split(",") if name.strip()]
+))
+
+def current_outlet():
+    return st.session_state.get('outlet', DEFAULT_OUTLET)
 
 # ============================================
 # CATEGORIZATION ENGINE
 # ============================================
 
-KEYWORDS_DATABASE = {
+# Seeds the stored taxonomy until the first keyword edit is saved
+DEFAULT_KEYWORDS = {
     "Dairy & Milk Products": ["milk", "butter", "cheese", "paneer", "curd", "ghee", "cream", "dahi", "malai"],
     "Meat, Poultry & Seafood": ["chicken", "mutton", "fish", "eggs", "prawns", "meat", "keema"],
     "Vegetables": ["onion", "tomato", "potato", "carrot", "beans", "cabbage", "spinach", "palak", "gobi"],
@@ -105,46 +207,675 @@ KEYWORDS_DATABASE = {
     "Beverages & Drinks": ["tea", "coffee", "juice", "water", "cold drink", "chai"],
     "Cleaning & Kitchen Supplies": ["tissue", "napkin", "detergent", "soap", "foil", "cleaner"]
 }
+# Fuzzy tier: minimum similarity (1 - edit distance / longer length), or None to turn it off
+FUZZY_THRESHOLD = 0.75
+# Shorter words only match exactly: one letter off a four-letter word is
+# too often another word ("coke" -> cake, "soup" -> soap, "card" -> curd)
+FUZZY_MIN_LENGTH = 5
+# Words this long may be two typos away; shorter ones only one
+FUZZY_TWO_EDIT_LENGTH = 8
+# Upper bound on typos per word, whatever the threshold allows; also sizes the index
+FUZZY_MAX_EDITS = 2
+
+# Common Hindi / Hinglish names -> the keyword they mean; used by the fuzzy tier
+TRANSLITERATIONS = {
+    "tamatar": "tomato", "tamater": "tomato",
+    "pyaz": "onion", "pyaaz": "onion", "kanda": "onion",
+    "aloo": "potato", "alu": "potato", "batata": "potato",
+    "gajar": "carrot", "gobhi": "gobi", "patta gobhi": "cabbage",
+    "doodh": "milk", "dudh": "milk", "makhan": "butter", "makkhan": "butter",
+    "anda": "eggs", "ande": "eggs", "murgi": "chicken", "murga": "chicken",
+    "machli": "fish", "machhi": "fish", "jhinga": "prawns",
+    "chawal": "rice", "gehun": "wheat", "gehu": "wheat",
+    "namak": "salt", "kali mirch": "pepper", "mirchi": "chilli", "mirch": "chilli",
+    "kela": "banana", "aam": "mango", "santra": "orange", "angoor": "grapes",
+    "seb": "apple", "papita": "papaya",
+    "pani": "water", "paani": "water", "tel": "oil", "sarson tel": "mustard oil",
+    "double roti": "bread", "pao": "pav", "sabun": "soap",
+}
+
+def _deletes(term, edits):
+    """term plus every string made by deleting up to `edits` characters from it."""
+    variants = {term}
+    frontier = {term}
+    for _ in range(edits):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+    return variants
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (adjacent swaps cost 1), capped at limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        char_a = a[i - 1]
+        for j in range(1, len(b) + 1):
+            char_b = b[j - 1]
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                value = min(value, before_previous[j - 2] + 1)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+class FuzzyIndex:
+    """Approximate lookups over keyword terms by edit distance.
+
+    Symmetric-delete index: every term is stored under each string left by
+    deleting up to max_edits of its characters. Two strings within k edits
+    (swaps included) always share such a variant, so a lookup only
+    generates the query's own deletes, collects the terms filed under them
+    and checks those few with edit_distance.
+    """
+
+    def __init__(self, term_ranks, threshold=FUZZY_THRESHOLD, min_length=FUZZY_MIN_LENGTH,
+                 max_edits=FUZZY_MAX_EDITS, two_edit_length=FUZZY_TWO_EDIT_LENGTH):
+        self.term_ranks = term_ranks
+        self.threshold = threshold
+        self.min_length = min_length
+        self.max_edits = max_edits
+        self.two_edit_length = two_edit_length
+        self.variants = {}
+        for term in term_ranks:
+            if len(term) >= min_length:
+                for variant in _deletes(term, max_edits):
+                    self.variants.setdefault(variant, []).append(term)
+
+    def lookup(self, word):
+        """Return (similarity, rank) of the closest term, or None if none is close enough."""
+        rank = self.term_ranks.get(word)
+        if rank is not None:
+            return 1.0, rank
+        if len(word) < self.min_length:
+            return None
+
+        # The word's length allows one or two typos; the longest term that
+        # could still pass the threshold bounds the budget further
+        budget = min(
+            self.max_edits,
+            1 if len(word) < self.two_edit_length else 2,
+            int(len(word) / self.threshold * (1 - self.threshold) + 1e-9)
+        )
+        if budget == 0:
+            return None
+
+        candidates = set()
+        for variant in _deletes(word, budget):
+            candidates.update(self.variants.get(variant, ()))
+
+        best = None
+        for term in candidates:
+            longer = max(len(term), len(word))
+            limit = min(budget, int(longer * (1 - self.threshold) + 1e-9))
+            distance = edit_distance(word, term, limit)
+            if distance > limit:
+                continue
+            candidate = (1 - distance / longer, -self.term_ranks[term])
+            if best is None or candidate > best:
+                best = candidate
+        if best is None:
+            return None
+        return best[0], -best[1]
+
+class KeywordIndex:
+    """Compiled lookup structure for a {category: keywords} taxonomy.
+
+    Exact matches go through a dict, substring matches through an
+    Aho-Corasick automaton, so categorizing a name is a single pass over
+    its characters instead of a scan over every keyword of every category.
+    Results follow the same first-match-wins order as the plain scans:
+    an exact hit always beats a substring hit, and among several hits the
+    category that appears first in the database wins.
+
+    Names that miss both passes go to a fuzzy tier. It tries each word and
+    the whole name against the keywords and the TRANSLITERATIONS aliases,
+    allowing a few typos. The most similar term wins, with ties going to
+    the earlier category. That tier is built on the first miss, and its
+    hits carry their similarity as confidence instead of 1.0, so review
+    shows them like the model's guesses.
+    """
+
+    def __init__(self, keywords_database, fuzzy_threshold=FUZZY_THRESHOLD, aliases=TRANSLITERATIONS):
+        self.categories = list(keywords_database.keys())
+        self.exact = {}
+        self.always_rank = None
+        self.fuzzy_threshold = fuzzy_threshold
+        self.aliases = aliases
+        self.term_ranks = {}
+        self._fuzzy = None
+
+        # Automaton: goto transitions, failure links and, per node, the best
+        # (lowest) category rank of any keyword ending at that node.
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [None]
+
+        for rank, (category, keywords) in enumerate(keywords_database.items()):
+            for keyword in keywords:
+                self.exact.setdefault(keyword, category)
+                self.term_ranks.setdefault(keyword, rank)
+                if keyword == "":
+                    # "" is a substring of everything
+                    if self.always_rank is None:
+                        self.always_rank = rank
+                    continue
+                self._insert(keyword, rank)
+
+        self._build_failure_links()
+
+    def _insert(self, keyword, rank):
+        node = 0
+        for char in keyword:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.best.append(None)
+            node = next_node
+        if self.best[node] is None or rank < self.best[node]:
+            self.best[node] = rank
+
+    def _build_failure_links(self):
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                link = self.goto[fallback].get(char, 0)
+                self.fail[child] = link if link != child else 0
+                # Inherit matches that end at the failure node
+                inherited = self.best[self.fail[child]]
+                if inherited is not None and (self.best[child] is None or inherited < self.best[child]):
+                    self.best[child] = inherited
+
+    def categorize(self, item_lower):
+        return self.categorize_scored(item_lower)[0]
+
+    def categorize_scored(self, item_lower):
+        """(category, confidence): 1.0 for keyword hits, the similarity for fuzzy ones."""
+        category = self.exact.get(item_lower)
+        if category is not None:
+            return category, 1.0
+
+        found = self.always_rank
+        if found == 0:
+            return self.categories[0], 1.0
+
+        goto, fail, best = self.goto, self.fail, self.best
+        node = 0
+        for char in item_lower:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            rank = best[node]
+            if rank is not None and (found is None or rank < found):
+                found = rank
+                if found == 0:
+                    break
+
+        if found is None:
+            return self._categorize_fuzzy(item_lower)
+        return self.categories[found], 1.0
+
+    @property
+    def fuzzy(self):
+        if self._fuzzy is None:
+            term_ranks = dict(self.term_ranks)
+            for alias, keyword in self.aliases.items():
+                rank = self.term_ranks.get(keyword)
+                if rank is not None:
+                    term_ranks.setdefault(alias, rank)
+            self._fuzzy = FuzzyIndex(term_ranks, self.fuzzy_threshold)
+        return self._fuzzy
+
+    def _categorize_fuzzy(self, item_lower):
+        if self.fuzzy_threshold is None:
+            return "Uncategorized", 0.0
+        words = re.findall(r"\w+", item_lower)
+        queries = words + [" ".join(words)] if len(words) > 1 else words
+
+        best = None
+        for query in queries:
+            match = self.fuzzy.lookup(query)
+            if match is not None and (best is None or (match[0], -match[1]) > (best[0], -best[1])):
+                best = match
+        if best is None:
+            return "Uncategorized", 0.0
+        return self.categories[best[1]], best[0]
+
+CATEGORIZE_CACHE_SIZE = 4096
+KEYWORDS_POLL_SECONDS = 30
+KEYWORDS_WRITE_ATTEMPTS = 8
+KEYWORDS_RETRY_BACKOFF = 0.05
+
+class KeywordConflictError(Exception):
+    """Raised when a keyword edit keeps losing to concurrent edits."""
+
+class KeywordStore:
+    """Keyword taxonomy shared through storage, with a compiled local copy.
+    
+    The taxonomy lives in settings/keywords as an ordered list of
+    {name, keywords} entries (order decides which category wins a tie)
+    plus a version that every edit increments. Each process keeps the
+    version it last loaded along with its KeywordIndex and categorization
+    cache, and reloads only when the stored version moves on: as soon as
+    a snapshot listener delivers it (see LiveData.watch_keywords), or
+    otherwise through a version-only read at most every poll_interval.
+    """
+    
+    def __init__(self, client=None, poll_interval=KEYWORDS_POLL_SECONDS, defaults=None, outlet=DEFAULT_OUTLET):
+        self.db = client or db
+        self.doc_ref = outlet_root(self.db, outlet).collection('settings').document('keywords')
+        self.poll_interval = poll_interval
+        self.defaults = DEFAULT_KEYWORDS if defaults is None else defaults
+        self.watched = False
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self.version = None
+        self.database = {}
+        self.index = None
+        self._categorize = None
+    
+    @staticmethod
+    def _decode(data):
+        return {entry['name']: list(entry['keywords']) for entry in data.get('categories', [])}
+    
+    @staticmethod
+    def _encode(database):
+        return [{'name': name, 'keywords': list(keywords)} for name, keywords in database.items()]
+    
+    def _install(self, version, database):
+        # Caller holds the lock
+        self.index = KeywordIndex(database)
+        self._categorize = functools.lru_cache(maxsize=CATEGORIZE_CACHE_SIZE)(self.index.categorize_scored)
+        self.database = database
+        self.version = version
+    
+    def apply_snapshot(self, snapshot):
+        """Adopt a read of settings/keywords if it is newer than the local copy."""
+        data = snapshot.to_dict() if snapshot.exists else None
+        version = data.get('version', 0) if data else 0
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self.version is None or version > self.version:
+                self._install(version, self._decode(data) if data else copy.deepcopy(self.defaults))
+    
+    def refresh(self):
+        """Reload if the stored version changed; polls at most every poll_interval."""
+        with self._lock:
+            if self.version is not None and (self.watched or time.monotonic() - self._checked_at < self.poll_interval):
+                return
+            loaded = self.version is not None
+        
+        if loaded:
+            probe = self.doc_ref.get(field_paths=['version'])
+            stored = probe.to_dict().get('version', 0) if probe.exists else 0
+            with self._lock:
+                if stored == self.version:
+                    self._checked_at = time.monotonic()
+                    return
+        self.apply_snapshot(self.doc_ref.get())
+    
+    def invalidate(self):
+        """Forget the local copy so the next access reloads and recompiles it."""
+        with self._lock:
+            self.version = None
+    
+    def get_database(self):
+        self.refresh()
+        return self.database
+    
+    def get_index(self):
+        self.refresh()
+        return self.index
+    
+    def categorizer(self):
+        """Cached categorize_scored(item_lower) -> (category, confidence) for the current version."""
+        self.refresh()
+        return self._categorize
+    
+    def update(self, mutate):
+        """Apply mutate(database) to the stored taxonomy and bump its version.
+        
+        mutate edits the {category: keywords} dict in place and returns a
+        result; a falsy result means nothing changed and skips the write.
+        The write is conditioned on the document's update time, so an edit
+        from another process in between makes it retry from a fresh read.
+        """
+        for attempt in range(KEYWORDS_WRITE_ATTEMPTS):
+            snapshot = self.doc_ref.get()
+            data = snapshot.to_dict() if snapshot.exists else None
+            database = self._decode(data) if data else copy.deepcopy(self.defaults)
+            version = data.get('version', 0) if data else 0
+            
+            result = mutate(database)
+            if not result:
+                self.apply_snapshot(snapshot)
+                return result
+            
+            fields = {
+                'version': version + 1,
+                'categories': self._encode(database),
+                'updated_at': firestore.SERVER_TIMESTAMP
+            }
+            try:
+                if snapshot.exists:
+                    self.doc_ref.update(fields, option=self.db.write_option(last_update_time=snapshot.update_time))
+                else:
+                    self.doc_ref.create(fields)
+            except (gcp_exceptions.AlreadyExists, gcp_exceptions.FailedPrecondition, gcp_exceptions.Aborted):
+                time.sleep(random.uniform(0, KEYWORDS_RETRY_BACKOFF * (2 ** attempt)))
+                continue
+            
+            with self._lock:
+                self._checked_at = time.monotonic()
+                if self.version is None or version + 1 > self.version:
+                    self._install(version + 1, database)
+            return result
+        
+        raise KeywordConflictError(f"Keyword update failed after {KEYWORDS_WRITE_ATTEMPTS} attempts")
+
+@st.cache_resource
+def get_keyword_store(outlet=DEFAULT_OUTLET):
+    return KeywordStore(outlet=outlet)
+
+keyword_store = LazyResource(lambda: get_keyword_store(current_outlet()))
+
+def get_keywords():
+    """Current taxonomy as {category: [keywords]} in display order. Read-only."""
+    return keyword_store.get_database()
+
+def get_keyword_index():
+    """Return the compiled index for the current taxonomy version."""
+    return keyword_store.get_index()
+
+def invalidate_keyword_index():
+    """Drop the local copy; the next lookup reloads and recompiles it."""
+    keyword_store.invalidate()
+
 def add_new_category(category_name, keywords_list):
     """Add a new category to the database."""
-    if category_name not in KEYWORDS_DATABASE:
-        KEYWORDS_DATABASE[category_name] = keywords_list
+    def add(database):
+        if category_name in database:
+            return False
+        database[category_name] = list(keywords_list)
         return True
-    return False
+    
+    return keyword_store.update(add)
 
 # Function to add item to existing category
 def add_item_to_category(category_name, item_name):
     """Add an item keyword to existing category."""
-    if category_name in KEYWORDS_DATABASE:
-        item_lower = item_name.lower().strip()
-        if item_lower not in KEYWORDS_DATABASE[category_name]:
-            KEYWORDS_DATABASE[category_name].append(item_lower)
+    item_lower = item_name.lower().strip()
+    
+    def add(database):
+        if category_name in database and item_lower not in database[category_name]:
+            database[category_name].append(item_lower)
             return True
-    return False
+        return False
+    
+    return keyword_store.update(add)
+
+def remove_item_from_category(category_name, item_name):
+    """Remove an item keyword from a category."""
+    return apply_keyword_edits(removals=[(category_name, item_name)]) > 0
+
+def move_item_between_categories(item_name, from_category, to_category):
+    """Move an item keyword from one category to another."""
+    return apply_keyword_edits(moves=[(item_name, from_category, to_category)]) > 0
+
+def apply_keyword_edits(removals=(), moves=()):
+    """Remove and move many keywords in one write.
+    
+    removals holds (category, keyword) pairs and moves holds
+    (keyword, from_category, to_category) triples. Returns how many
+    keywords changed.
+    """
+    def edit(database):
+        changed = 0
+        for category_name, item_name in removals:
+            if item_name in database.get(category_name, []):
+                database[category_name].remove(item_name)
+                changed += 1
+        for item_name, from_category, to_category in moves:
+            if item_name not in database.get(from_category, []) or to_category not in database:
+                continue
+            database[from_category].remove(item_name)
+            if item_name not in database[to_category]:
+                database[to_category].append(item_name)
+            changed += 1
+        return changed
+    
+    return keyword_store.update(edit)
+
+# Learned fallback for names the keyword rules leave Uncategorized
+MODEL_MIN_CONFIDENCE = 0.6
+
+@st.cache_resource
+def get_category_model(outlet=DEFAULT_OUTLET):
+    model = CategoryModel()
+    ModelTrainer(model, outlet_root(db, outlet).collection('orders')).start()
+    return model
+
+category_model = LazyResource(lambda: get_category_model(current_outlet()))
+
+def learned_categories(names, model=None, store=None):
+    """Model guesses as (category, confidence); Uncategorized when unsure or unknown.
+    
+    model and store default to the current outlet's category_model and
+    keyword_store.
+    """
+    known = (store or keyword_store).get_database()
+    guesses = []
+    for category, confidence in (model or category_model).predict(names):
+        if category in known and confidence >= MODEL_MIN_CONFIDENCE:
+            guesses.append((category, confidence))
+        else:
+            guesses.append(("Uncategorized", confidence))
+    return guesses
+
+def learn_corrections(pairs):
+    """Teach the model (item_name, category) decisions made by hand."""
+    pairs = [(name, category) for name, category in pairs if category != "Uncategorized"]
+    if pairs:
+        category_model.partial_fit([name for name, _ in pairs], [category for _, category in pairs])
+
+def categorize_items_scored(names, store=None, model=None):
+    """(category, confidence) per name.
+    
+    Keyword hits score 1.0 and fuzzy hits their similarity; names the
+    rules leave Uncategorized go to the model in one batch. store and
+    model default to the current outlet's keyword_store and category_model.
+    """
+    categorize = (store or keyword_store).categorizer()
+    scored = [categorize(name.lower().strip()) if name else ("Uncategorized", 0.0) for name in names]
+    misses = [index for index, (category, _) in enumerate(scored) if category == "Uncategorized" and names[index]]
+    if misses:
+        guesses = learned_categories([names[index] for index in misses], model, store)
+        for index, guess in zip(misses, guesses):
+            scored[index] = guess
+    return scored
+
 def categorize_item(item_name):
     if not item_name:
         return "Uncategorized"
     
     item_lower = item_name.lower().strip()
-    
-    for category, keywords in KEYWORDS_DATABASE.items():
-        if item_lower in keywords:
-            return category
-    
-    for category, keywords in KEYWORDS_DATABASE.items():
-        for keyword in keywords:
-            if keyword in item_lower:
-                return category
-    
-    return "Uncategorized"
+    category, _ = keyword_store.categorizer()(item_lower)
+    if category == "Uncategorized":
+        category, _ = learned_categories([item_name])[0]
+    return category
+
+def categorize_items(names):
+    """Categorize a batch of item names, reusing cached results for repeats."""
+    return [category for category, _ in categorize_items_scored(names)]
+
+def categorize_cache_stats():
+    """Hit/miss counters for the categorization cache since the last change."""
+    info = keyword_store.categorizer().cache_info()
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize
+    }
+
+# ============================================
+# ITEM PARSING
+# ============================================
+
+def parse_item_line(line):
+    """Split an 'Item Name, Quantity' line into (item_name, quantity)."""
+    line = line.strip()
+    if ',' in line:
+        parts = line.split(',', 1)
+        return parts[0].strip(), parts[1].strip()
+    return line, ""
+
+# Unit spelling -> (canonical unit, multiplier into it). A bare number counts pieces.
+QUANTITY_UNITS = {}
+for _unit, _factor, _spellings in (
+    ("kg", 1, ["kg", "kgs", "kilo", "kilos", "kilogram", "kilograms"]),
+    ("kg", 0.001, ["g", "gm", "gms", "gr", "grm", "gram", "grams"]),
+    ("l", 1, ["l", "lt", "ltr", "ltrs", "litre", "litres", "liter", "liters"]),
+    ("l", 0.001, ["ml", "mls"]),
+    ("pcs", 1, ["", "pc", "pcs", "piece", "pieces", "no", "nos", "unit", "units"]),
+    ("pcs", 12, ["dozen", "dozens", "doz", "dz"]),
+    ("pack", 1, ["pack", "packs", "packet", "packets", "pkt", "pkts"]),
+    ("box", 1, ["box", "boxes"]),
+    ("bottle", 1, ["bottle", "bottles", "btl"]),
+    ("tray", 1, ["tray", "trays"]),
+    ("bunch", 1, ["bunch", "bunches"]),
+):
+    for _spelling in _spellings:
+        QUANTITY_UNITS[_spelling] = (_unit, _factor)
+
+# Optional "2 x" multiplier, a number or fraction, then an optional unit word
+QUANTITY_PATTERN = re.compile(
+    r"^\s*(?:(\d+)\s*[x×*]\s*)?(\d+(?:\.\d+)?(?:\s*/\s*\d+)?|\.\d+)\s*([a-z]*)\.?\s*$"
+)
+
+@functools.lru_cache(maxsize=1024)
+def parse_quantity(text):
+    """Normalize a quantity like '500g' or '2 dozen' to (value, unit); (None, None) if unreadable."""
+    match = QUANTITY_PATTERN.match(text.lower()) if text else None
+    if match is None:
+        return None, None
+    count, number, spelling = match.groups()
+    canonical = QUANTITY_UNITS.get(spelling)
+    if canonical is None:
+        return None, None
+    
+    if '/' in number:
+        numerator, denominator = (float(part) for part in number.split('/'))
+        if denominator == 0:
+            return None, None
+        value = numerator / denominator
+    else:
+        value = float(number)
+    unit, factor = canonical
+    return round(value * factor * (int(count) if count else 1), 6), unit
+
+def parse_quantities(texts):
+    """parse_quantity over a whole paste; each distinct string is parsed once."""
+    parsed = {text: parse_quantity(text) for text in set(texts)}
+    return [parsed[text] for text in texts]
+
+def quantity_fields(value_unit):
+    value, unit = value_unit
+    return {"quantity_value": value, "quantity_unit": unit}
+
+def format_quantity(value, unit):
+    """Render a parsed quantity, e.g. (1.5, 'kg') -> '1.5 kg'."""
+    return f"{value:g} {unit}"
+
+def parse_bulk_items(text):
+    """Parse a pasted block, one item per line, skipping blank lines."""
+    entries = []
+    for line in (text or "").strip().split('\n'):
+        item_name, quantity = parse_item_line(line)
+        if item_name:
+            entries.append((item_name, quantity))
+    return entries
 
 # ============================================
 # VENDOR MANAGER
 # ============================================
 
+VENDOR_CACHE_TTL = 300  # seconds before the vendor index is reloaded
+
 class VendorManager:
-    def __init__(self):
-        self.vendors_ref = db.collection('vendors')
+    """Vendor CRUD plus an in-process category -> vendor index.
+    
+    The index is filled by one bulk read of the vendors collection and
+    reused until it is older than cache_ttl or a write through this
+    manager invalidates it. The TTL bounds how stale it can get when
+    another process edits vendors. Each vendor's message template is
+    compiled when the index is built and kept with it.
+    """
+    
+    def __init__(self, client=None, cache_ttl=VENDOR_CACHE_TTL, outlet=DEFAULT_OUTLET):
+        self.db = client or db
+        self.vendors_ref = outlet_root(self.db, outlet).collection('vendors')
+        self.cache_ttl = cache_ttl
+        # Bumped whenever the index is replaced, so callers can key cached work on it
+        self.version = 0
+        self._lock = threading.Lock()
+        self._vendors = None
+        self._by_category = {}
+        self._templates = {}
+        self._loaded_at = 0.0
+    
+    def _install(self, vendor_docs):
+        # Caller holds the lock; docs arrive in document ID order
+        vendors = []
+        by_category = {}
+        templates = {}
+        for doc in vendor_docs:
+            vendor = doc.to_dict()
+            vendor['id'] = doc.id
+            vendors.append(vendor)
+            # Same winner as the old where(...).limit(1): lowest document ID
+            by_category.setdefault(vendor.get('category'), vendor)
+            templates[doc.id] = compile_vendor_template(vendor)
+        self._vendors = vendors
+        self._by_category = by_category
+        self._templates = templates
+        self._loaded_at = time.monotonic()
+        self.version += 1
+    
+    def _index(self):
+        with self._lock:
+            if self._vendors is None or time.monotonic() - self._loaded_at > self.cache_ttl:
+                self._install(list(self.vendors_ref.stream()))
+            return self._vendors, self._by_category
+    
+    def replace_index(self, vendor_docs):
+        """Rebuild the index from already-fetched vendor snapshots."""
+        with self._lock:
+            self._install(sorted(vendor_docs, key=lambda doc: doc.id))
+    
+    def invalidate(self):
+        with self._lock:
+            self._vendors = None
+            self._by_category = {}
+            self._templates = {}
+            self.version += 1
     
     def add_vendor(self, category, vendor_name, phone, vendor_type="WhatsApp"):
         vendor_data = {
@@ -155,123 +886,1206 @@ class VendorManager:
             "created_at": firestore.SERVER_TIMESTAMP
         }
         self.vendors_ref.add(vendor_data)
+        self.invalidate()
         return True
     
     def get_all_vendors(self):
-        docs = self.vendors_ref.stream()
-        vendors = []
-        for doc in docs:
-            vendor = doc.to_dict()
-            vendor['id'] = doc.id
-            vendors.append(vendor)
-        return vendors
+        vendors, _ = self._index()
+        return [dict(vendor) for vendor in vendors]
     
     def get_vendor_by_category(self, category):
-        docs = self.vendors_ref.where('category', '==', category).limit(1).stream()
-        for doc in docs:
-            vendor = doc.to_dict()
-            vendor['id'] = doc.id
-            return vendor
-        return None
+        _, by_category = self._index()
+        vendor = by_category.get(category)
+        return dict(vendor) if vendor else None
+    
+    def get_vendors_for_categories(self, categories):
+        """{category: vendor} for every category that has one, from a single index lookup."""
+        _, by_category = self._index()
+        return {category: dict(by_category[category]) for category in categories if category in by_category}
+    
+    def get_template(self, vendor):
+        """The vendor's compiled MessageTemplate, from the index when it is there."""
+        with self._lock:
+            template = self._templates.get(vendor.get('id'))
+        return template or compile_vendor_template(vendor)
+    
+    def index_version(self):
+        """Current index version, reloading the index first if it has expired."""
+        self._index()
+        return self.version
+    
+    def update_vendor(self, vendor_id, updates):
+        self.vendors_ref.document(vendor_id).update(updates)
+        self.invalidate()
+        return True
     
     def delete_vendor(self, vendor_id):
         self.vendors_ref.document(vendor_id).delete()
+        self.invalidate()
         return True
 
-vendor_manager = VendorManager()
+@st.cache_resource
+def get_vendor_manager(outlet=DEFAULT_OUTLET):
+    # Shared by every session of the outlet in this process so the vendor index is too
+    return VendorManager(outlet=outlet)
+
+vendor_manager = LazyResource(lambda: get_vendor_manager(current_outlet()))
+
+# ============================================
+# ORDER ANALYTICS
+# ============================================
+
+ROLLUP_PAGE_SIZE = 200
+ROLLUP_BATCH_SIZE = 450
+# Orders whose rollups need at most this many writes get them in the send
+# batch itself; bigger ones are flagged and applied right after
+ROLLUP_INLINE_WRITES = 300
+# How often the background repairer looks for orders still flagged
+ROLLUP_REPAIR_SECONDS = 300
+
+def rollup_doc_id(text):
+    """Firestore-safe document ID for a category or item name."""
+    doc_id = urllib.parse.quote(text.lower().strip(), safe='')
+    if doc_id in ('', '.', '..') or len(doc_id) > 1500:
+        doc_id = hashlib.sha1(text.encode()).hexdigest()
+    return doc_id
+
+def day_key(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%d')
+
+class AnalyticsManager:
+    """Precomputed ordering volumes, kept up to date as orders are sent.
+    
+    analytics_daily/{YYYY-MM-DD}: order_count, item_count, categories map
+    analytics_categories/{category}: category, order_count, item_count
+    analytics_items/{item}: name, category, count, quantities ({unit: total}), last_ordered
+    
+    Each sent order adds to these with Increment transforms, so reading
+    analytics never touches the orders collection. Normally the increments
+    commit in the same batch as the order (see order_writes). An order too
+    big for that is created with rollups_pending and applied by
+    record_order, which repair_pending re-runs for any order still flagged.
+    """
+    
+    def __init__(self, client=None, outlet=DEFAULT_OUTLET):
+        self.db = client or db
+        root = outlet_root(self.db, outlet)
+        self.orders_ref = root.collection('orders')
+        self.daily_ref = root.collection('analytics_daily')
+        self.categories_ref = root.collection('analytics_categories')
+        self.items_ref = root.collection('analytics_items')
+        self.applied_ref = root.collection('analytics_applied')
+    
+    def _summarize(self, items):
+        by_category = {}
+        by_item = {}
+        for item in items:
+            category = item.get('category', 'Uncategorized')
+            by_category[category] = by_category.get(category, 0) + 1
+            
+            name = item.get('name', '').lower().strip()
+            if name:
+                entry = by_item.setdefault(name, {'count': 0, 'category': category, 'quantities': {}})
+                entry['count'] += 1
+                entry['category'] = category
+                # Older items predate parsed quantities
+                if 'quantity_unit' in item:
+                    value, unit = item.get('quantity_value'), item.get('quantity_unit')
+                else:
+                    value, unit = parse_quantity(item.get('quantity', ''))
+                if unit is not None:
+                    entry['quantities'][unit] = entry['quantities'].get(unit, 0) + value
+        return by_category, by_item
+    
+    def _commit_writes(self, writes):
+        """Commit (ref, data, merge) writes in batches; data None deletes."""
+        for start in range(0, len(writes), ROLLUP_BATCH_SIZE):
+            batch = self.db.batch()
+            for ref, data, merge in writes[start:start + ROLLUP_BATCH_SIZE]:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data, merge=merge)
+            batch.commit()
+    
+    def order_writes(self, items, sent_at):
+        """(ref, data, merge) rollup writes that add one sent order."""
+        if not items:
+            return []
+        
+        by_category, by_item = self._summarize(items)
+        day = day_key(sent_at)
+        
+        writes = [(self.daily_ref.document(day), {
+            'date': day,
+            'order_count': firestore.Increment(1),
+            'item_count': firestore.Increment(len(items)),
+            'categories': {category: firestore.Increment(count) for category, count in by_category.items()}
+        }, True)]
+        
+        for category, count in by_category.items():
+            writes.append((self.categories_ref.document(rollup_doc_id(category)), {
+                'category': category,
+                'order_count': firestore.Increment(1),
+                'item_count': firestore.Increment(count)
+            }, True))
+        
+        for name, entry in by_item.items():
+            writes.append((self.items_ref.document(rollup_doc_id(name)), {
+                'name': name,
+                'category': entry['category'],
+                'count': firestore.Increment(entry['count']),
+                'quantities': {unit: firestore.Increment(total) for unit, total in entry['quantities'].items()},
+                'last_ordered': sent_at
+            }, True))
+        return writes
+    
+    def record_order(self, order_id, items, sent_at):
+        """Apply a flagged order's rollups in batches, then clear its rollups_pending flag.
+        
+        Each batch commits an analytics_applied/{order_id}.{n} marker with
+        its increments, so running this again for the same order skips the
+        batches that already landed.
+        """
+        writes = self.order_writes(items, sent_at)
+        chunks = [writes[start:start + ROLLUP_BATCH_SIZE] for start in range(0, len(writes), ROLLUP_BATCH_SIZE)]
+        markers = [self.applied_ref.document(f"{order_id}.{index}") for index in range(len(chunks))]
+        landed = {doc.id for doc in self.db.get_all(markers) if doc.exists} if markers else set()
+        
+        for marker, chunk in zip(markers, chunks):
+            if marker.id in landed:
+                continue
+            batch = self.db.batch()
+            for ref, data, merge in chunk:
+                batch.set(ref, data, merge=merge)
+            batch.create(marker, {'order_id': order_id, 'applied_at': firestore.SERVER_TIMESTAMP})
+            batch.commit()
+        self.orders_ref.document(order_id).update({'rollups_pending': firestore.DELETE_FIELD})
+    
+    def repair_pending(self, limit=ROLLUP_PAGE_SIZE):
+        """Finish rollups for orders still flagged rollups_pending. Returns how many were repaired."""
+        repaired = 0
+        for doc in self.orders_ref.where('rollups_pending', '==', True).limit(limit).stream():
+            order = doc.to_dict()
+            sent_at = order.get('sent_at')
+            if isinstance(sent_at, datetime):
+                try:
+                    self.record_order(doc.id, order.get('items') or [], sent_at)
+                except gcp_exceptions.Conflict:
+                    # Another repair landed the same batch first; it clears the flag
+                    pass
+                repaired += 1
+        return repaired
+    
+    def get_daily(self, days=30):
+        docs = self.daily_ref.order_by('date', direction=firestore.Query.DESCENDING).limit(days).stream()
+        return [doc.to_dict() for doc in docs]
+    
+    def get_categories(self):
+        docs = self.categories_ref.order_by('item_count', direction=firestore.Query.DESCENDING).stream()
+        return [doc.to_dict() for doc in docs]
+    
+    def get_top_items(self, limit=20):
+        docs = self.items_ref.order_by('count', direction=firestore.Query.DESCENDING).limit(limit).stream()
+        return [doc.to_dict() for doc in docs]
+    
+    def rebuild_rollups(self, page_size=ROLLUP_PAGE_SIZE):
+        """Recompute every rollup from the orders collection.
+        
+        Orders are streamed page by page, so memory grows with the number
+        of distinct days, categories and items rather than with the number
+        of orders. Existing rollup documents are then replaced. Orders sent
+        while this runs may be counted twice or not at all; run it when the
+        app is idle. Orders still flagged rollups_pending are counted here
+        and their flag is cleared. Returns the number of orders processed.
+        """
+        daily = {}
+        categories = {}
+        items = {}
+        flagged = []
+        processed = 0
+        cursor = None
+        
+        while True:
+            query = self.orders_ref.order_by('sent_at').select(['sent_at', 'items', 'rollups_pending']).limit(page_size)
+            if cursor is not None:
+                query = query.start_after(cursor)
+            docs = list(query.stream())
+            
+            for doc in docs:
+                order = doc.to_dict()
+                order_items = order.get('items') or []
+                sent_at = order.get('sent_at')
+                if order.get('rollups_pending'):
+                    # Counted here, so repair_pending must not add it again
+                    flagged.append(doc.reference)
+                if not order_items or not isinstance(sent_at, datetime):
+                    continue
+                
+                by_category, by_item = self._summarize(order_items)
+                day = day_key(sent_at)
+                
+                totals = daily.setdefault(day, {'date': day, 'order_count': 0, 'item_count': 0, 'categories': {}})
+                totals['order_count'] += 1
+                totals['item_count'] += len(order_items)
+                for category, count in by_category.items():
+                    totals['categories'][category] = totals['categories'].get(category, 0) + count
+                    entry = categories.setdefault(category, {'category': category, 'order_count': 0, 'item_count': 0})
+                    entry['order_count'] += 1
+                    entry['item_count'] += count
+                
+                for name, summary in by_item.items():
+                    entry = items.setdefault(name, {
+                        'name': name, 'category': summary['category'], 'count': 0, 'quantities': {}, 'last_ordered': sent_at
+                    })
+                    entry['count'] += summary['count']
+                    for unit, total in summary['quantities'].items():
+                        entry['quantities'][unit] = entry['quantities'].get(unit, 0) + total
+                    entry['category'] = summary['category']
+                    entry['last_ordered'] = max(entry['last_ordered'], sent_at)
+                
+                processed += 1
+            
+            if len(docs) < page_size:
+                break
+            cursor = docs[-1]
+        
+        writes = []
+        for collection_ref, rollups, key in (
+            (self.daily_ref, daily, lambda entry: entry['date']),
+            (self.categories_ref, categories, lambda entry: rollup_doc_id(entry['category'])),
+            (self.items_ref, items, lambda entry: rollup_doc_id(entry['name']))
+        ):
+            wanted = set()
+            for entry in rollups.values():
+                wanted.add(key(entry))
+                writes.append((collection_ref.document(key(entry)), entry, False))
+            for doc_ref in collection_ref.list_documents():
+                if doc_ref.id not in wanted:
+                    writes.append((doc_ref, None, None))
+        
+        self._commit_writes(writes)
+        for start in range(0, len(flagged), ROLLUP_BATCH_SIZE):
+            batch = self.db.batch()
+            for order_ref in flagged[start:start + ROLLUP_BATCH_SIZE]:
+                batch.update(order_ref, {'rollups_pending': firestore.DELETE_FIELD})
+            batch.commit()
+        return processed
+
+class RollupRepairer:
+    """Background thread that runs AnalyticsManager.repair_pending every interval seconds."""
+    
+    def __init__(self, analytics, interval=ROLLUP_REPAIR_SECONDS):
+        self.analytics = analytics
+        self.interval = interval
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.analytics.repair_pending()
+                self.error = None
+            except Exception as error:
+                # The orders stay flagged; try again next interval
+                self.error = error
+            self._stop.wait(self.interval)
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rollup-repairer", daemon=True)
+            self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stop.set()
+
+@st.cache_resource
+def get_rollup_repairer(outlet=DEFAULT_OUTLET):
+    return RollupRepairer(AnalyticsManager(outlet=outlet)).start()
 
 # ============================================
 # DRAFT MANAGER
 # ============================================
 
+DRAFT_WRITE_ATTEMPTS = 8
+DRAFT_RETRY_BACKOFF = 0.05
+
+# "array": all items in one array field of drafts/current-draft.
+# "subcollection": one document per item under drafts/current-draft/items,
+# with the draft document holding only status and counters. An array draft
+# is migrated automatically the first time it is loaded in this mode.
+DRAFT_STORAGE_MODE = "array"
+
+# Item writes per batch; Firestore allows 500 writes per commit
+DRAFT_BATCH_SIZE = 450
+
+def draft_conflict_errors():
+    """Errors raised when another writer touched the draft between our read and write."""
+    return (
+        gcp_exceptions.Aborted,
+        gcp_exceptions.AlreadyExists,
+        gcp_exceptions.FailedPrecondition,
+        gcp_exceptions.NotFound
+    )
+
+class DraftConflictError(Exception):
+    """Raised when a draft write keeps losing to concurrent writers."""
+
+def sync_transient_errors():
+    """Queue failures that mean "offline or busy, try later".
+    
+    Anything else counts towards dead-lettering the queued write. Token
+    refreshes fail with the google.auth errors while the link is down, and
+    RetryError is transient both on its own and through the error it wraps
+    (OutboxWorker.is_transient follows the cause).
+    """
+    from google.auth import exceptions as auth_exceptions
+    
+    return (
+        DraftConflictError,
+        OSError,
+        auth_exceptions.TransportError,
+        auth_exceptions.RefreshError,
+        gcp_exceptions.ServiceUnavailable,
+        gcp_exceptions.DeadlineExceeded,
+        gcp_exceptions.TooManyRequests,
+        gcp_exceptions.InternalServerError,
+        gcp_exceptions.RetryError
+    )
+
+# How long applied_writes markers are meant to live; set a Firestore TTL
+# policy on expires_at to have them removed
+APPLIED_WRITES_TTL = timedelta(days=7)
+
+def new_item_id():
+    return uuid.uuid4().hex
+
+def ensure_item_ids(items):
+    """Give items saved before stable IDs existed a deterministic ID.
+
+    The ID is derived from the item's content and its position among
+    identical items, so every reader computes the same value until the next
+    write persists it.
+    """
+    seen = {}
+    for item in items:
+        if item.get('id'):
+            continue
+        fingerprint = "|".join(str(item.get(field, "")) for field in ("name", "quantity", "category", "added_by", "added_at"))
+        occurrence = seen.get(fingerprint, 0)
+        seen[fingerprint] = occurrence + 1
+        digest = hashlib.sha1(f"{fingerprint}|{occurrence}".encode()).hexdigest()[:16]
+        item['id'] = f"legacy-{digest}"
+    return items
+
+# Fields a merge rewrites on an existing draft line
+MERGED_FIELDS = ('quantity', 'quantity_value', 'contributions', 'added_by')
+
+def item_merge_key(item):
+    """Key under which draft lines are combined; None when the quantity cannot be summed."""
+    unit = item.get('quantity_unit')
+    if unit is None or item.get('quantity_value') is None:
+        return None
+    name = " ".join(item.get('name', '').lower().split())
+    return f"{item.get('category', '')}|{name}|{unit}"
+
+def merged_item_id(key):
+    """Document ID for a mergeable line in the items subcollection, derived from its key."""
+    return "merged-" + hashlib.sha1(key.encode()).hexdigest()[:20]
+
+def item_contributions(item):
+    """Who asked for how much of a line; unmerged lines have a single contribution."""
+    return item.get('contributions') or [{'added_by': item.get('added_by', ''), 'quantity_value': item['quantity_value']}]
+
+def merge_item(target, item):
+    """Fold item's quantity and contributors into target, which has the same merge key."""
+    contributions = [dict(contribution) for contribution in item_contributions(target)]
+    by_person = {contribution['added_by']: contribution for contribution in contributions}
+    for contribution in item_contributions(item):
+        existing = by_person.get(contribution['added_by'])
+        if existing is None:
+            existing = by_person[contribution['added_by']] = {'added_by': contribution['added_by'], 'quantity_value': 0}
+            contributions.append(existing)
+        existing['quantity_value'] = round(existing['quantity_value'] + contribution['quantity_value'], 6)
+    
+    target['quantity_value'] = round(target['quantity_value'] + item['quantity_value'], 6)
+    target['quantity'] = format_quantity(target['quantity_value'], target['quantity_unit'])
+    target['contributions'] = contributions
+    target['added_by'] = ", ".join(contribution['added_by'] for contribution in contributions)
+    return target
+
+def merge_into(items, new_items):
+    """Append new_items to items, folding each into an existing line with its merge key."""
+    by_key = {}
+    for item in items:
+        key = item_merge_key(item)
+        if key is not None:
+            by_key.setdefault(key, item)
+    
+    for item in new_items:
+        key = item_merge_key(item)
+        target = by_key.get(key) if key is not None else None
+        if target is not None:
+            merge_item(target, item)
+            continue
+        item = dict(item)
+        items.append(item)
+        if key is not None:
+            by_key[key] = item
+    return items
+
+def edit_items(items, quantities, categories, removals):
+    """Apply quantity and category edits and removals by item ID. Returns (kept items, changed count)."""
+    kept = []
+    changed = 0
+    for item in items:
+        if item['id'] in removals:
+            changed += 1
+            continue
+        quantity = quantities.get(item['id'], item['quantity']).strip()
+        category = categories.get(item['id'], item['category'])
+        if quantity != item['quantity'] or category != item['category']:
+            if category != item['category']:
+                item.pop('category_confidence', None)
+            if quantity != item['quantity']:
+                item.update(quantity_fields(parse_quantity(quantity)))
+                item.pop('contributions', None)
+            item['quantity'] = quantity
+            item['category'] = category
+            changed += 1
+        kept.append(item)
+    return kept, changed
+
+def recategorize(items, item_name, category, from_category):
+    """Move items called item_name out of from_category in place. Returns the count."""
+    changed = 0
+    for item in items:
+        if item['name'] == item_name and item['category'] == from_category:
+            item['category'] = category
+            # Chosen by hand, so no longer a guess
+            item.pop('category_confidence', None)
+            changed += 1
+    return changed
+
+def _reset_draft_fields():
+    return {
+        'items': [],
+        'status': 'Draft',
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'approved_by': firestore.DELETE_FIELD,
+        'approved_at': firestore.DELETE_FIELD
+    }
+
+# Fields read for history listings; the items stay on the server until opened
+ORDER_SUMMARY_FIELDS = ['sent_at', 'sent_by', 'approved_by', 'status', 'item_count']
+
 class DraftManager:
-    def __init__(self):
-        self.draft_ref = db.collection('drafts').document('current-draft')
-        self.orders_ref = db.collection('orders')
+    def __init__(self, client=None, storage_mode=None, live=None, outlet=DEFAULT_OUTLET, sync=None,
+                 keyword_store=None, category_model=None):
+        self.db = client or db
+        # Categorization reads the same storage as the draft. With an explicit
+        # client and no model, the learned tier starts untrained and abstains.
+        if client is not None:
+            keyword_store = keyword_store or KeywordStore(client=client, outlet=outlet)
+            category_model = category_model or CategoryModel()
+        self.keyword_store = keyword_store
+        self.category_model = category_model
+        self.live = live
+        # With an OutboxWorker, adds, removals and sends are queued locally
+        # and written by the worker's own DraftManager
+        self.sync = sync
+        self.outlet = outlet
+        self.storage_mode = storage_mode or DRAFT_STORAGE_MODE
+        # One draft document per outlet, so outlets never contend with each other
+        root = outlet_root(self.db, outlet)
+        self.draft_ref = root.collection('drafts').document('current-draft')
+        self.items_ref = self.draft_ref.collection('items')
+        self.orders_ref = root.collection('orders')
+        self.applied_ref = root.collection('applied_writes')
+        self.analytics = AnalyticsManager(self.db, outlet)
+    
+    @property
+    def uses_subcollection(self):
+        return self.storage_mode == "subcollection"
+    
+    def _load_draft(self):
+        """Return (draft snapshot, draft dict) in the get_draft() shape."""
+        draft_doc = self.draft_ref.get()
+        if draft_doc.exists:
+            draft = draft_doc.to_dict()
+        else:
+            draft = {"items": [], "status": "Draft"}
+        
+        if not self.uses_subcollection:
+            draft['items'] = ensure_item_ids(draft.get('items', []))
+            return draft_doc, draft
+        
+        if isinstance(draft.get('items'), list) and draft['items']:
+            self.migrate_to_subcollection()
+            return self._load_draft()
+        
+        items = []
+        for doc in self.items_ref.order_by('seq').stream():
+            item = doc.to_dict()
+            item.pop('seq', None)
+            item['id'] = doc.id
+            items.append(item)
+        draft['items'] = items
+        return draft_doc, draft
+    
+    def _mutate_draft(self, mutate, reserve=0):
+        """Read-modify-write the draft with optimistic concurrency.
+        
+        mutate(draft, batch) edits the draft dict and returns
+        (updates, result): the top-level fields to write, or None to skip the
+        write, and the value to hand back to the caller. It may also queue
+        extra writes on batch, which commit atomically with the draft.
+        
+        The draft write carries a last-update-time precondition (or is a
+        create when the draft does not exist yet), so a concurrent change
+        makes it fail instead of being overwritten. The cycle is then
+        retried from a fresh read with jittered backoff. reserve is how many
+        writes mutate may add to the batch, to keep it under the batch limit.
+        """
+        for attempt in range(DRAFT_WRITE_ATTEMPTS):
+            draft_doc, draft = self._load_draft()
+            old_items = copy.deepcopy(draft['items']) if self.uses_subcollection else None
+            
+            batch = self.db.batch()
+            updates, result = mutate(draft, batch)
+            if updates is None:
+                return result
+            
+            updates['updated_at'] = firestore.SERVER_TIMESTAMP
+            item_writes = []
+            if self.uses_subcollection and 'items' in updates:
+                new_items = updates.pop('items')
+                item_writes = self._item_writes(old_items, new_items)
+                updates['item_count'] = len(new_items)
+            
+            if draft_doc.exists:
+                option = self.db.write_option(last_update_time=draft_doc.update_time)
+                batch.update(self.draft_ref, updates, option=option)
+            else:
+                created = {'status': 'Draft', 'created_at': firestore.SERVER_TIMESTAMP}
+                created.update({k: v for k, v in updates.items() if v is not firestore.DELETE_FIELD})
+                batch.create(self.draft_ref, created)
+            
+            try:
+                # The first batch carries the preconditioned draft write, so a
+                # conflict aborts before any item document is touched
+                self._commit_item_writes(batch, item_writes, reserve)
+                return result
+            except draft_conflict_errors():
+                time.sleep(random.uniform(0, DRAFT_RETRY_BACKOFF * (2 ** attempt)))
+        
+        raise DraftConflictError(f"Draft update failed after {DRAFT_WRITE_ATTEMPTS} attempts")
+    
+    def _commit(self, batch):
+        results = batch.commit()
+        self._note_write(results)
+        return results
+    
+    def _note_write(self, results):
+        # Keep readers off the live copy until it has caught up with this write
+        if self.live is not None and results:
+            self.live.note_draft_write(max(result.update_time for result in results))
+    
+    def _item_writes(self, old_items, new_items):
+        """Diff two item lists into per-document writes for the items subcollection."""
+        old_by_id = {item['id']: item for item in old_items}
+        writes = []
+        seq = time.time_ns()
+        
+        for offset, item in enumerate(new_items):
+            fields = {key: value for key, value in item.items() if key != 'id'}
+            old = old_by_id.pop(item['id'], None)
+            if old is None:
+                fields['seq'] = seq + offset
+                writes.append(('create', item['id'], fields))
+            else:
+                changed = {key: value for key, value in fields.items() if old.get(key) != value}
+                changed.update({key: firestore.DELETE_FIELD for key in old if key != 'id' and key not in fields})
+                if changed:
+                    writes.append(('update', item['id'], changed))
+        
+        for item_id in old_by_id:
+            writes.append(('delete', item_id, None))
+        return writes
+    
+    def _commit_item_writes(self, batch, item_writes, reserve=0):
+        # The first batch already holds the draft write plus up to reserve others
+        first = DRAFT_BATCH_SIZE - reserve
+        bounds = [0] + list(range(first, len(item_writes), DRAFT_BATCH_SIZE)) + [len(item_writes)]
+        for start, stop in zip(bounds, bounds[1:]):
+            if batch is None:
+                batch = self.db.batch()
+            for kind, item_id, fields in item_writes[start:stop]:
+                item_ref = self.items_ref.document(item_id)
+                if kind == 'create':
+                    batch.create(item_ref, fields)
+                elif kind == 'update':
+                    batch.update(item_ref, fields)
+                else:
+                    batch.delete(item_ref)
+            self._commit(batch)
+            batch = None
+    
+    def migrate_to_subcollection(self):
+        """Move an array-layout draft into one document per item.
+        
+        Item documents are written first and keyed by item ID, so the
+        migration can be re-run safely. The draft document then swaps its
+        items array for an item_count under a precondition; if the draft
+        changed meanwhile, the whole migration is redone from a fresh read.
+        Returns the number of migrated items.
+        """
+        for attempt in range(DRAFT_WRITE_ATTEMPTS):
+            draft_doc = self.draft_ref.get()
+            if not draft_doc.exists:
+                return 0
+            
+            items = draft_doc.to_dict().get('items')
+            if not isinstance(items, list):
+                return 0
+            items = ensure_item_ids(items)
+            
+            writes = []
+            wanted = set()
+            for position, item in enumerate(items):
+                fields = {key: value for key, value in item.items() if key != 'id'}
+                fields['seq'] = position
+                wanted.add(item['id'])
+                writes.append(('set', item['id'], fields))
+            
+            # Drop leftovers from an earlier attempt that lost a race
+            for item_ref in self.items_ref.list_documents():
+                if item_ref.id not in wanted:
+                    writes.append(('delete', item_ref.id, None))
+            
+            for start in range(0, len(writes), DRAFT_BATCH_SIZE):
+                batch = self.db.batch()
+                for kind, item_id, fields in writes[start:start + DRAFT_BATCH_SIZE]:
+                    if kind == 'set':
+                        batch.set(self.items_ref.document(item_id), fields)
+                    else:
+                        batch.delete(self.items_ref.document(item_id))
+                batch.commit()
+            
+            try:
+                result = self.draft_ref.update({
+                    'items': firestore.DELETE_FIELD,
+                    'item_count': len(items),
+                    'updated_at': firestore.SERVER_TIMESTAMP
+                }, option=self.db.write_option(last_update_time=draft_doc.update_time))
+                self._note_write([result])
+                return len(items)
+            except draft_conflict_errors():
+                time.sleep(random.uniform(0, DRAFT_RETRY_BACKOFF * (2 ** attempt)))
+        
+        raise DraftConflictError(f"Draft migration failed after {DRAFT_WRITE_ATTEMPTS} attempts")
     
     def add_item(self, item_name, quantity, added_by):
-        category = categorize_item(item_name)
+        return self.add_items([(item_name, quantity)], added_by)[0]
+    
+    def add_items(self, entries, added_by):
+        """Add (item_name, quantity) pairs to the draft in one write, or queue them."""
+        entries = [(name.strip(), (quantity or "").strip()) for name, quantity in entries if name and name.strip()]
+        if not entries:
+            return []
         
-        item = {
-            "name": item_name.strip(),
-            "quantity": quantity.strip(),
-            "category": category,
-            "added_by": added_by,
-            "added_at": datetime.now().isoformat()
-        }
+        scored = categorize_items_scored([name for name, _ in entries], self.keyword_store, self.category_model)
+        categories = [category for category, _ in scored]
+        parsed = parse_quantities([quantity for _, quantity in entries])
+        added_at = datetime.now().isoformat()
         
-        draft_doc = self.draft_ref.get()
+        new_items = []
+        for (name, quantity), (category, confidence), value_unit in zip(entries, scored, parsed):
+            item = {
+                "id": new_item_id(),
+                "name": name,
+                "quantity": quantity,
+                **quantity_fields(value_unit),
+                "category": category,
+                "added_by": added_by,
+                "added_at": added_at
+            }
+            if category != "Uncategorized" and confidence < 1.0:
+                # A close match or a model guess; review shows it and a manual change clears it
+                item["category_confidence"] = round(confidence, 3)
+            if self.uses_subcollection and item_merge_key(item) is not None:
+                # Known up front so a queued removal can name the item
+                item["id"] = merged_item_id(item_merge_key(item))
+            new_items.append(item)
         
-        if draft_doc.exists:
-            current_items = draft_doc.to_dict().get('items', [])
-            current_items.append(item)
-            self.draft_ref.update({
-                'items': current_items,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            })
+        if self.sync is not None:
+            self._enqueue('add_items', {'items': new_items})
         else:
-            self.draft_ref.set({
-                'items': [item],
-                'status': 'Draft',
-                'created_at': firestore.SERVER_TIMESTAMP,
+            self._write_items(new_items)
+        return categories
+    
+    def _write_items(self, new_items, keys=()):
+        if self.uses_subcollection:
+            self._add_item_documents(new_items, keys)
+            return
+        
+        def append(draft, batch):
+            self._mark_applied(batch, keys, 'add_items')
+            # Same product, category and unit as an existing line: sum into it
+            return {'items': merge_into(draft['items'], new_items)}, None
+        
+        self._mutate_draft(append)
+    
+    def _add_item_documents(self, new_items, keys=()):
+        """Subcollection add: merge lines with a summable quantity, create the rest.
+        
+        A mergeable line is stored under an ID derived from its merge key,
+        so its existing document is found with one batched read rather than
+        by scanning the draft. Lines that cannot be merged are blind creates
+        plus a counter increment, with no read at all. Outbox keys are
+        marked applied with the last batch. For a single queued entry that
+        needs several batches, each earlier batch commits its own
+        "{key}.{n}" marker, so a replay after an interruption skips the
+        batches that already landed instead of merging them twice.
+        """
+        keyed = {}
+        plain = []
+        for item in new_items:
+            key = item_merge_key(item)
+            if key is None:
+                plain.append(item)
+            elif key in keyed:
+                merge_item(keyed[key], item)
+            else:
+                keyed[key] = dict(item)
+        
+        # Plain items carry a None key
+        writes = list(keyed.items()) + [(None, item) for item in plain]
+        starts = range(0, len(writes), DRAFT_BATCH_SIZE)
+        parts = [f"{keys[0]}.{index}" for index in range(len(starts) - 1)] if len(keys) == 1 else []
+        landed = self._applied_keys(parts)
+        seq = time.time_ns()
+        for index, start in enumerate(starts):
+            if index == len(starts) - 1:
+                marks = keys
+            elif parts:
+                if parts[index] in landed:
+                    continue
+                marks = [parts[index]]
+            else:
+                marks = ()
+            self._write_item_documents(writes[start:start + DRAFT_BATCH_SIZE], seq + start, marks)
+    
+    def _write_item_documents(self, writes, seq, keys=()):
+        """Write one batch of (merge key, item) pairs, retrying on concurrent adds.
+        
+        Existing lines are updated under a last-update-time precondition and
+        new ones are creates, so a racing writer makes the batch fail as a
+        whole and it is redone from a fresh read.
+        """
+        for attempt in range(DRAFT_WRITE_ATTEMPTS):
+            # Plain creates need no read, except on a retry: an outbox replay
+            # may find them already written
+            refs = [self.items_ref.document(item['id']) for key, item in writes if key is not None or attempt > 0]
+            snapshots = {doc.id: doc for doc in self.db.get_all(refs)} if refs else {}
+            
+            batch = self.db.batch()
+            created = 0
+            for offset, (key, item) in enumerate(writes):
+                item_ref = self.items_ref.document(item['id'])
+                snapshot = snapshots.get(item['id'])
+                if snapshot is not None and snapshot.exists:
+                    if key is None:
+                        continue
+                    existing = snapshot.to_dict()
+                    if item_merge_key(existing) == key:
+                        merge_item(existing, item)
+                        option = self.db.write_option(last_update_time=snapshot.update_time)
+                        batch.update(item_ref, {field: existing[field] for field in MERGED_FIELDS}, option=option)
+                        continue
+                    # The line at this ID was edited into another product; start a new one
+                    item_ref = self.items_ref.document(new_item_id())
+                fields = {field: value for field, value in item.items() if field != 'id'}
+                fields['seq'] = seq + offset
+                batch.create(item_ref, fields)
+                created += 1
+            
+            self._mark_applied(batch, keys, 'add_items')
+            batch.set(self.draft_ref, {
+                'item_count': firestore.Increment(created),
                 'updated_at': firestore.SERVER_TIMESTAMP
-            })
+            }, merge=True)
+            try:
+                self._commit(batch)
+                return
+            except draft_conflict_errors():
+                time.sleep(random.uniform(0, DRAFT_RETRY_BACKOFF * (2 ** attempt)))
         
-        return category
+        raise DraftConflictError(f"Item write failed after {DRAFT_WRITE_ATTEMPTS} attempts")
     
     def get_draft(self):
-        draft_doc = self.draft_ref.get()
-        if not draft_doc.exists:
-            return {"items": [], "status": "Draft"}
-        return draft_doc.to_dict()
+        draft = self.live.get_draft() if self.live is not None else None
+        if draft is None:
+            draft = self._load_draft()[1]
+        if self.sync is not None:
+            draft = self._with_pending(draft)
+        return draft
+    
+    # --- Offline queue ---
+    
+    def _enqueue(self, operation, payload):
+        self.sync.outbox.enqueue(self.outlet, operation, payload)
+        self.sync.notify()
+    
+    def _with_pending(self, draft):
+        """Lay queued writes over a stored draft; affected items get pending_sync."""
+        entries = self.sync.outbox.pending(self.outlet)
+        if not entries:
+            return draft
+        
+        items = draft['items']
+        touched = set()
+        edited = set()
+        for _, operation, payload in entries:
+            if operation == 'add_items':
+                added = [dict(item, pending_sync=True) for item in payload['items']]
+                touched.update(key for key in map(item_merge_key, added) if key is not None)
+                items = merge_into(items, added)
+            elif operation == 'remove_item':
+                items = [item for item in items if item['id'] != payload['item_id']]
+            elif operation == 'edit_items':
+                items, _ = edit_items(items, payload['quantities'], payload['categories'], set(payload['removals']))
+                edited.update(payload['quantities'], payload['categories'])
+            elif operation == 'recategorize_items':
+                for item in items:
+                    if item['name'] == payload['item_name'] and item['category'] == payload['from_category']:
+                        edited.add(item['id'])
+                recategorize(items, payload['item_name'], payload['category'], payload['from_category'])
+            elif operation == 'approve_draft' and items:
+                draft = dict(draft, status='Approved', approved_by=payload['approved_by'])
+            elif operation in ('clear_draft', 'mark_as_sent'):
+                items = []
+                touched = set()
+                edited = set()
+                draft = {key: value for key, value in draft.items() if key not in ('approved_by', 'approved_at')}
+                draft['status'] = 'Draft'
+        
+        for item in items:
+            if item['id'] in edited or item_merge_key(item) in touched:
+                item['pending_sync'] = True
+        draft['items'] = items
+        draft['pending_writes'] = len(entries)
+        return draft
+    
+    def _applied_keys(self, keys):
+        """Outbox keys whose writes already reached storage."""
+        if not keys:
+            return set()
+        refs = [self.applied_ref.document(key) for key in keys]
+        return {doc.id for doc in self.db.get_all(refs) if doc.exists}
+    
+    def _mark_applied(self, batch, keys, operation):
+        # Committed in the same batch as the write it records
+        expires_at = datetime.now(timezone.utc) + APPLIED_WRITES_TTL
+        for key in keys:
+            batch.create(self.applied_ref.document(key), {
+                'operation': operation,
+                'applied_at': firestore.SERVER_TIMESTAMP,
+                'expires_at': expires_at
+            })
+    
+    def apply_queued(self, entries):
+        """Write (key, operation, payload) entries from the outbox, oldest first.
+        
+        Each write commits together with an applied_writes/{key} marker and
+        keys that already have one are skipped, so an entry replayed after a
+        crash or a lost acknowledgement is not applied twice. Consecutive
+        adds go out as a single write when they fit one batch; larger ones go
+        entry by entry, so each can mark its batches as it writes them.
+        """
+        applied = self._applied_keys([key for key, _, _ in entries])
+        entries = [entry for entry in entries if entry[0] not in applied]
+        for operation, group in itertools.groupby(entries, key=lambda entry: entry[1]):
+            group = list(group)
+            if operation == 'add_items':
+                items = [item for _, _, payload in group for item in payload['items']]
+                if len(items) <= DRAFT_BATCH_SIZE:
+                    self._write_items(items, [key for key, _, _ in group])
+                    continue
+                for key, _, payload in group:
+                    self._write_items(payload['items'], [key])
+                continue
+            for key, _, payload in group:
+                if operation == 'remove_item':
+                    self._remove_item(payload['item_id'], [key])
+                elif operation == 'edit_items':
+                    self._edit_items(payload['quantities'], payload['categories'], payload['removals'], [key])
+                elif operation == 'recategorize_items':
+                    self._recategorize_items(payload['item_name'], payload['category'], payload['from_category'],
+                                             [key])
+                elif operation == 'clear_draft':
+                    self._clear_draft([key])
+                elif operation == 'approve_draft':
+                    self._approve(payload['approved_by'], [key])
+                elif operation == 'mark_as_sent':
+                    self._send(payload['sent_by'], [key])
+                else:
+                    raise ValueError(f"Unknown queued operation: {operation}")
+    
+    def get_draft_version(self):
+        """Counter that changes whenever the live draft changes, or None."""
+        return self.live.draft_version if self.live is not None else None
     
     def approve_draft(self, approved_by):
-        draft = self.get_draft()
-        if len(draft.get('items', [])) == 0:
-            return False, "Cannot approve empty draft"
-        
-        self.draft_ref.update({
-            'status': 'Approved',
-            'approved_by': approved_by,
-            'approved_at': firestore.SERVER_TIMESTAMP
-        })
-        return True, "Draft approved successfully"
+        if self.sync is not None:
+            # Queued so it cannot land before the adds and edits ahead of it
+            if not self.get_draft()['items']:
+                return False, "Cannot approve empty draft"
+            self._enqueue('approve_draft', {'approved_by': approved_by})
+            return True, "Draft approved successfully"
+        return self._approve(approved_by)
+    
+    def _approve(self, approved_by, keys=()):
+        def approve(draft, batch):
+            if len(draft['items']) == 0:
+                return None, (False, "Cannot approve empty draft")
+            
+            self._mark_applied(batch, keys, 'approve_draft')
+            return {
+                'status': 'Approved',
+                'approved_by': approved_by,
+                'approved_at': firestore.SERVER_TIMESTAMP
+            }, (True, "Draft approved successfully")
+        
+        return self._mutate_draft(approve)
     
     def mark_as_sent(self, sent_by):
-        draft = self.get_draft()
-        order_data = draft.copy()
-        order_data['sent_by'] = sent_by
-        order_data['sent_at'] = firestore.SERVER_TIMESTAMP
-        order_data['status'] = 'Sent'
-        
-        self.orders_ref.add(order_data)
-        
-        self.draft_ref.set({
-            'items': [],
-            'status': 'Draft',
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
-        return True
+        if self.sync is not None:
+            self._enqueue('mark_as_sent', {'sent_by': sent_by})
+            return True
+        return self._send(sent_by)
+    
+    def _send(self, sent_by, keys=()):
+        sent = {}
+        sent_at = datetime.now(timezone.utc)
+        
+        def send(draft, batch):
+            self._mark_applied(batch, keys, 'mark_as_sent')
+            order_data = draft.copy()
+            order_data['item_count'] = len(draft['items'])
+            order_data['sent_by'] = sent_by
+            order_data['sent_at'] = firestore.SERVER_TIMESTAMP
+            order_data['status'] = 'Sent'
+            
+            order_ref = self.orders_ref.document()
+            rollups = self.analytics.order_writes(draft['items'], sent_at)
+            sent.clear()
+            if len(rollups) <= ROLLUP_INLINE_WRITES:
+                # Counted exactly when the order itself lands
+                for ref, data, merge in rollups:
+                    batch.set(ref, data, merge=merge)
+            else:
+                order_data['rollups_pending'] = True
+                sent.update(order_id=order_ref.id, items=draft['items'])
+            batch.create(order_ref, order_data)
+            return _reset_draft_fields(), True
+        
+        # Leave room in the first batch for the order, its rollups and the markers
+        result = self._mutate_draft(send, reserve=ROLLUP_INLINE_WRITES + len(keys) + 1)
+        
+        if sent:
+            try:
+                self.analytics.record_order(sent['order_id'], sent['items'], sent_at)
+            except (gcp_exceptions.GoogleAPICallError,) + sync_transient_errors() as error:
+                # The order stays flagged; RollupRepairer finishes it
+                logger.warning("rollups for order %s left pending: %r", sent['order_id'], error)
+        return result
+    
+    def remove_item(self, item_id):
+        if self.sync is not None:
+            removed = next((item for item in self.get_draft()['items'] if item['id'] == item_id), None)
+            if removed is not None:
+                self._enqueue('remove_item', {'item_id': item_id})
+            return removed
+        return self._remove_item(item_id)
     
-    def remove_item(self, index):
-        draft = self.get_draft()
-        items = draft.get('items', [])
+    def _remove_item(self, item_id, keys=()):
+        if self.uses_subcollection:
+            return self._remove_item_document(item_id, keys)
         
-        if 0 <= index < len(items):
-            removed = items.pop(index)
-            self.draft_ref.update({
-                'items': items,
+        def remove(draft, batch):
+            items = draft['items']
+            for position, item in enumerate(items):
+                if item['id'] == item_id:
+                    removed = items.pop(position)
+                    self._mark_applied(batch, keys, 'remove_item')
+                    return {'items': items}, removed
+            return None, None
+        
+        return self._mutate_draft(remove)
+    
+    def _remove_item_document(self, item_id, keys=()):
+        item_ref = self.items_ref.document(item_id)
+        for attempt in range(DRAFT_WRITE_ATTEMPTS):
+            item_doc = item_ref.get()
+            if not item_doc.exists:
+                return None
+            
+            batch = self.db.batch()
+            batch.delete(item_ref, option=self.db.write_option(last_update_time=item_doc.update_time))
+            self._mark_applied(batch, keys, 'remove_item')
+            batch.set(self.draft_ref, {
+                'item_count': firestore.Increment(-1),
                 'updated_at': firestore.SERVER_TIMESTAMP
-            })
+            }, merge=True)
+            try:
+                self._commit(batch)
+            except draft_conflict_errors():
+                time.sleep(random.uniform(0, DRAFT_RETRY_BACKOFF * (2 ** attempt)))
+                continue
+            
+            removed = item_doc.to_dict()
+            removed.pop('seq', None)
+            removed['id'] = item_id
             return removed
-        return None
+        
+        raise DraftConflictError(f"Item removal failed after {DRAFT_WRITE_ATTEMPTS} attempts")
+    
+    def update_item_quantity(self, item_id, quantity):
+        """Set one item's quantity. Returns False if the item is gone."""
+        quantity = quantity.strip()
+        fields = {'quantity': quantity, **quantity_fields(parse_quantity(quantity))}
+        
+        if self.sync is not None:
+            # Queued behind any pending add of the same item, so it lands after it
+            if not any(item['id'] == item_id for item in self.get_draft()['items']):
+                return False
+            self._enqueue('edit_items', {'quantities': {item_id: quantity}, 'categories': {}, 'removals': []})
+            return True
+        
+        if self.uses_subcollection:
+            try:
+                # A hand-set total no longer matches the per-person breakdown
+                result = self.items_ref.document(item_id).update(dict(fields, contributions=firestore.DELETE_FIELD))
+                self._note_write([result])
+                return True
+            except gcp_exceptions.NotFound:
+                return False
+        
+        def update(draft, batch):
+            for item in draft['items']:
+                if item['id'] == item_id:
+                    item.update(fields)
+                    item.pop('contributions', None)
+                    return {'items': draft['items']}, True
+            return None, False
+        
+        return self._mutate_draft(update)
+    
+    def apply_item_edits(self, quantities=None, categories=None, removals=()):
+        """Apply many item edits in a single draft write, or queue them.
+        
+        quantities and categories map item IDs to new values and removals
+        holds item IDs to delete. IDs that are no longer in the draft are
+        skipped. Returns how many items were changed or removed.
+        """
+        quantities = quantities or {}
+        categories = categories or {}
+        removals = sorted(set(removals))
+        
+        if self.sync is not None:
+            # Counted against the draft as it will be once the queue drains
+            _, changed = edit_items(self.get_draft()['items'], quantities, categories, set(removals))
+            if changed:
+                self._enqueue('edit_items', {'quantities': quantities, 'categories': categories, 'removals': removals})
+            return changed
+        return self._edit_items(quantities, categories, removals)
+    
+    def _edit_items(self, quantities, categories, removals, keys=()):
+        removals = set(removals)
+        
+        def edit(draft, batch):
+            kept, changed = edit_items(draft['items'], quantities, categories, removals)
+            if not changed:
+                return None, 0
+            self._mark_applied(batch, keys, 'edit_items')
+            return {'items': kept}, changed
+        
+        return self._mutate_draft(edit)
+    
+    def recategorize_items(self, item_name, category, from_category="Uncategorized"):
+        """Move every item called item_name out of from_category. Returns the count."""
+        if self.sync is not None:
+            changed = recategorize(self.get_draft()['items'], item_name, category, from_category)
+            if changed:
+                self._enqueue('recategorize_items', {
+                    'item_name': item_name, 'category': category, 'from_category': from_category
+                })
+            return changed
+        return self._recategorize_items(item_name, category, from_category)
+    
+    def _recategorize_items(self, item_name, category, from_category, keys=()):
+        def move(draft, batch):
+            changed = recategorize(draft['items'], item_name, category, from_category)
+            if changed == 0:
+                return None, 0
+            self._mark_applied(batch, keys, 'recategorize_items')
+            return {'items': draft['items']}, changed
+        
+        return self._mutate_draft(move)
     
     def clear_draft(self):
-        self.draft_ref.set({
-            'items': [],
-            'status': 'Draft',
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
+        if self.sync is not None:
+            self._enqueue('clear_draft', {})
+            return
+        self._clear_draft()
+    
+    def _clear_draft(self, keys=()):
+        def clear(draft, batch):
+            self._mark_applied(batch, keys, 'clear_draft')
+            return _reset_draft_fields(), None
+        
+        self._mutate_draft(clear)
+    
+    def get_order_page(self, page_size=10, cursor=None, start=None, end=None, sent_by=None):
+        """Fetch one page of order summaries, newest first.
+        
+        Returns (orders, next_cursor). Only ORDER_SUMMARY_FIELDS are read,
+        not the items; use get_order() for those. Pass next_cursor back in
+        to get the following page; it is None once the history is exhausted.
+        start/end bound sent_at (end exclusive). Filtering by sent_by needs
+        a composite index on (sent_by, sent_at desc).
+        """
+        query = self.orders_ref
+        if sent_by:
+            query = query.where('sent_by', '==', sent_by)
+        if start is not None:
+            query = query.where('sent_at', '>=', start)
+        if end is not None:
+            query = query.where('sent_at', '<', end)
+        query = query.order_by('sent_at', direction=firestore.Query.DESCENDING).select(ORDER_SUMMARY_FIELDS)
+        if cursor is not None:
+            query = query.start_after(cursor)
+        
+        docs = list(query.limit(page_size).stream())
+        orders = []
+        for doc in docs:
+            order = doc.to_dict()
+            order['id'] = doc.id
+            orders.append(order)
+        
+        next_cursor = docs[-1] if len(docs) == page_size else None
+        return orders, next_cursor
+    
+    def get_order(self, order_id):
+        doc = self.orders_ref.document(order_id).get()
+        if not doc.exists:
+            return None
+        order = doc.to_dict()
+        order['id'] = doc.id
+        return order
     
     def get_order_history(self, limit=10):
         docs = self.orders_ref.order_by('sent_at', direction=firestore.Query.DESCENDING).limit(limit).stream()
@@ -282,24 +2096,304 @@ class DraftManager:
             orders.append(order)
         return orders
 
-draft_manager = DraftManager()
+# ============================================
+# LIVE DATA
+# ============================================
+
+LIVE_LISTENERS = True
+
+class LiveData:
+    """Process-wide copies of the draft, vendors and keywords, kept fresh by on_snapshot.
+    
+    Every session in the process reads from the same in-memory copy instead
+    of issuing its own document reads on each rerun. draft_version and
+    vendors_version increase on every delivered change, so callers can key
+    cached work on them and skip it when nothing changed.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watches = []
+        self._subcollection = False
+        self._header = None
+        self._items = None
+        self._draft = None
+        self._read_time = None
+        self._written_at = None
+        self.draft_version = 0
+        self.vendors_version = 0
+    
+    def watch_draft(self, manager):
+        self._subcollection = manager.uses_subcollection
+        self._watches.append(manager.draft_ref.on_snapshot(self._on_draft_header))
+        if self._subcollection:
+            self._watches.append(manager.items_ref.order_by('seq').on_snapshot(self._on_draft_items))
+    
+    def watch_vendors(self, vendor_manager):
+        def on_vendors(docs, changes, read_time):
+            vendor_manager.replace_index(docs)
+            with self._lock:
+                self.vendors_version += 1
+        
+        self._watches.append(vendor_manager.vendors_ref.on_snapshot(on_vendors))
+    
+    def watch_keywords(self, keyword_store):
+        def on_keywords(docs, changes, read_time):
+            if docs:
+                keyword_store.apply_snapshot(docs[0])
+        
+        # Edits arrive through the listener, so the store stops polling
+        keyword_store.watched = True
+        self._watches.append(keyword_store.doc_ref.on_snapshot(on_keywords))
+    
+    def stop(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+    
+    def _on_draft_header(self, docs, changes, read_time):
+        snapshot = docs[0] if docs else None
+        header = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+        with self._lock:
+            self._header = header or {"items": [], "status": "Draft"}
+            self._publish(read_time)
+    
+    def _on_draft_items(self, docs, changes, read_time):
+        items = []
+        for doc in docs:
+            item = doc.to_dict()
+            item.pop('seq', None)
+            item['id'] = doc.id
+            items.append(item)
+        with self._lock:
+            self._items = items
+            self._publish(read_time)
+    
+    def _publish(self, read_time):
+        # Caller holds the lock
+        if self._header is None or (self._subcollection and self._items is None):
+            return
+        if self._subcollection and isinstance(self._header.get('items'), list) and self._header['items']:
+            # Array layout still present; leave it to DraftManager to migrate
+            self._draft = None
+            return
+        draft = dict(self._header)
+        if self._subcollection:
+            draft['items'] = self._items
+        else:
+            draft['items'] = ensure_item_ids(draft.get('items', []))
+        self._draft = draft
+        if self._read_time is None or read_time > self._read_time:
+            self._read_time = read_time
+        self.draft_version += 1
+    
+    def note_draft_write(self, write_time):
+        with self._lock:
+            if self._written_at is None or write_time > self._written_at:
+                self._written_at = write_time
+    
+    def get_draft(self):
+        """Deep copy of the live draft, or None if it is missing or behind a local write."""
+        with self._lock:
+            if self._draft is None:
+                return None
+            if self._written_at is not None and (self._read_time is None or self._read_time < self._written_at):
+                return None
+            return copy.deepcopy(self._draft)
+
+@st.cache_resource
+def get_live_data(outlet=DEFAULT_OUTLET):
+    live = LiveData()
+    if LIVE_LISTENERS:
+        live.watch_draft(DraftManager(outlet=outlet))
+        live.watch_vendors(get_vendor_manager(outlet))
+        live.watch_keywords(get_keyword_store(outlet))
+    return live
+
+@st.cache_resource
+def get_sync_worker(outlet=DEFAULT_OUTLET):
+    """Background writer for the outlet's offline queue, or None without one."""
+    outbox = get_outbox()
+    if outbox is None:
+        return None
+    manager = DraftManager(live=get_live_data(outlet), outlet=outlet)
+    return OutboxWorker(outbox, outlet, manager.apply_queued, transient=sync_transient_errors()).start()
+
+live_data = LazyResource(lambda: get_live_data(current_outlet()))
+draft_manager = LazyResource(
+    lambda: DraftManager(live=live_data, outlet=current_outlet(), sync=get_sync_worker(current_outlet()))
+)
 
 # ============================================
 # MESSAGE GENERATOR
 # ============================================
 
-def generate_whatsapp_message(vendor_name, items):
-    message = f"Hi {vendor_name},\n\n"
-    message += "Order for tomorrow:\n\n"
-    
-    for item in items:
-        message += f"• {item['name']}"
-        if item['quantity']:
-            message += f" - {item['quantity']}"
-        message += "\n"
+# Wording per language. {delivery} becomes the today/tomorrow word, or
+# the delivery date when it is further out
+MESSAGE_LANGUAGES = {
+    "en": {
+        "greeting": "Hi {vendor_name},",
+        "intro": "Order for {delivery}:",
+        "closing": "Thanks!",
+        "today": "today",
+        "tomorrow": "tomorrow"
+    },
+    "hi": {
+        "greeting": "Namaste {vendor_name} ji,",
+        "intro": "{delivery} ke liye order:",
+        "closing": "Dhanyavaad!",
+        "today": "Aaj",
+        "tomorrow": "Kal"
+    }
+}
+
+DEFAULT_ITEM_FORMAT = "• {name} - {quantity}"
+DEFAULT_BARE_ITEM_FORMAT = "• {name}"
+DELIVERY_DATE_FORMAT = "%a %d %b"
+
+# Placeholders a template may use. {units} is the parsed quantity in
+# canonical units ("1.5 kg"), or the raw text when it could not be parsed.
+HEADER_FIELDS = {"vendor_name", "delivery", "delivery_date", "item_count", "category"}
+ITEM_FIELDS = {"name", "quantity", "units", "category"}
+
+def item_units(item):
+    value, unit = item.get('quantity_value'), item.get('quantity_unit')
+    if unit is None:
+        value, unit = parse_quantity(item.get('quantity', ''))
+    return format_quantity(value, unit) if unit is not None else item.get('quantity', '')
+
+# Format specs a placeholder may carry: optional fill and alignment, a
+# width of at most two digits and a precision, e.g. {name:<20} or {name:.12}
+TEMPLATE_SPEC = re.compile(r"(?:.?[<>^])?\d{0,2}(?:\.\d{1,2})?")
+TEMPLATE_SAMPLE_HEADER = {
+    "vendor_name": "Ramesh",
+    "delivery": "tomorrow",
+    "delivery_date": "Mon 01 Jan",
+    "item_count": 3,
+    "category": "Vegetables"
+}
+TEMPLATE_SAMPLE_ITEM = {"name": "Onion", "quantity": "1kg", "units": "1 kg", "category": "Vegetables"}
+
+def _template_fields(text, allowed, label):
+    """Placeholders used in a format string; ValueError for bad syntax, unknown names or specs."""
+    try:
+        parsed = [(field, spec, conversion) for _, field, spec, conversion in string.Formatter().parse(text)
+                  if field is not None]
+    except ValueError as error:
+        raise ValueError(f"{label}: {error}")
+    fields = {field for field, _, _ in parsed}
+    if "" in fields:
+        raise ValueError(f"{label}: placeholders need a name, e.g. {{name}}")
+    unknown = fields - allowed
+    if unknown:
+        raise ValueError(f"{label}: unknown placeholder {{{sorted(unknown)[0]}}}")
+    for field, spec, conversion in parsed:
+        if conversion is not None or not TEMPLATE_SPEC.fullmatch(spec):
+            raise ValueError(f"{label}: unsupported format for {{{field}}}")
+    return fields
+
+def _compile_format(text, allowed, label, sample):
+    """Check a format string and return its format_map, trial-rendered against sample fields."""
+    fields = _template_fields(text, allowed, label)
+    render = text.format_map
+    # Specs that do not suit the value ({item_count:.2}) fail here rather than on the send screen
+    try:
+        render(sample)
+    except Exception as error:
+        raise ValueError(f"{label}: {error}")
+    return render, fields
+
+class MessageTemplate:
+    """A vendor's message layout, checked and bound once, rendered with a single join.
+    
+    spec is the vendor's stored template dict: language, delivery_days, and
+    optional greeting, intro, closing, item and item_without_quantity
+    overrides. No spec gives the original "Hi {vendor}, Order for tomorrow"
+    message. Item lines are formatted over a mapping of ITEM_FIELDS only,
+    never over the stored item itself.
+    """
+    
+    def __init__(self, spec=None):
+        spec = spec or {}
+        self.spec = dict(spec)
+        wording = MESSAGE_LANGUAGES.get(spec.get('language'), MESSAGE_LANGUAGES['en'])
+        self.wording = wording
+        self.delivery_days = int(spec.get('delivery_days', 1))
+        
+        greeting = spec.get('greeting') or wording['greeting']
+        intro = spec.get('intro') or wording['intro']
+        closing = spec.get('closing') or wording['closing']
+        item = (spec.get('item') or DEFAULT_ITEM_FORMAT) + "\n"
+        bare_item = (spec.get('item_without_quantity') or DEFAULT_BARE_ITEM_FORMAT) + "\n"
+        
+        for text, label in ((greeting, "Greeting"), (intro, "Intro"), (closing, "Closing")):
+            _template_fields(text, HEADER_FIELDS, label)
+        self._header, _ = _compile_format(f"{greeting}\n\n{intro}\n\n", HEADER_FIELDS, "Greeting or intro",
+                                          TEMPLATE_SAMPLE_HEADER)
+        self._footer, _ = _compile_format(f"\n{closing}", HEADER_FIELDS, "Closing", TEMPLATE_SAMPLE_HEADER)
+        self._item, item_fields = _compile_format(item, ITEM_FIELDS, "Item line", TEMPLATE_SAMPLE_ITEM)
+        self._bare_item, bare_fields = _compile_format(
+            bare_item, ITEM_FIELDS, "Item line without quantity", TEMPLATE_SAMPLE_ITEM
+        )
+        self._units = "units" in item_fields | bare_fields
+    
+    def _delivery(self, today):
+        delivery_date = today + timedelta(days=self.delivery_days)
+        if self.delivery_days == 0:
+            word = self.wording['today']
+        elif self.delivery_days == 1:
+            word = self.wording['tomorrow']
+        else:
+            word = delivery_date.strftime(DELIVERY_DATE_FORMAT)
+        return word, delivery_date.strftime(DELIVERY_DATE_FORMAT)
+    
+    def _item_fields(self, item):
+        return {
+            "name": item.get('name', ''),
+            "quantity": item.get('quantity', ''),
+            "units": item_units(item) if self._units else "",
+            "category": item.get('category', '')
+        }
     
-    message += "\nThanks!"
-    return message
+    def render(self, vendor_name, items, category="", today=None):
+        delivery, delivery_date = self._delivery(today or datetime.now().date())
+        fields = {
+            "vendor_name": vendor_name,
+            "delivery": delivery,
+            "delivery_date": delivery_date,
+            "item_count": len(items),
+            "category": category
+        }
+        try:
+            return "".join([
+                self._header(fields),
+                *[
+                    (self._item if item.get('quantity') else self._bare_item)(self._item_fields(item))
+                    for item in items
+                ],
+                self._footer(fields)
+            ])
+        except Exception:
+            # A template that passed its checks but still fails on real data
+            # must not block sending; fall back to the default wording
+            if self is DEFAULT_TEMPLATE:
+                raise
+            return DEFAULT_TEMPLATE.render(vendor_name, items, category, today)
+
+DEFAULT_TEMPLATE = MessageTemplate()
+
+def compile_vendor_template(vendor):
+    """MessageTemplate for a vendor record; a missing or broken template gives the default."""
+    spec = vendor.get('template')
+    if not spec:
+        return DEFAULT_TEMPLATE
+    try:
+        return MessageTemplate(spec)
+    except Exception:
+        return DEFAULT_TEMPLATE
+
+def generate_whatsapp_message(vendor_name, items, template=None):
+    return (template or DEFAULT_TEMPLATE).render(vendor_name, items)
 
 def create_whatsapp_url(phone, message):
     clean_phone = ''.join(filter(str.isdigit, phone))
@@ -311,6 +2405,36 @@ def create_whatsapp_url(phone, message):
     url = f"https://wa.me/{clean_phone}?text={encoded_message}"
     return url
 
+def prepare_send_bundle(items):
+    """Group categorized items and build each vendor's message and link in one pass.
+    
+    Returns one section per category in first-seen order: category, items,
+    vendor (None when unmapped), message and url. Every vendor comes from a
+    single lookup in the vendor index, with its precompiled template.
+    """
+    by_category = {}
+    for item in items:
+        if item['category'] != 'Uncategorized':
+            by_category.setdefault(item['category'], []).append(item)
+    
+    vendors = vendor_manager.get_vendors_for_categories(by_category)
+    today = datetime.now().date()
+    sections = []
+    for category, cat_items in by_category.items():
+        vendor = vendors.get(category)
+        message = None
+        if vendor:
+            template = vendor_manager.get_template(vendor)
+            message = template.render(vendor['vendor_name'], cat_items, category, today)
+        sections.append({
+            "category": category,
+            "items": cat_items,
+            "vendor": vendor,
+            "message": message,
+            "url": create_whatsapp_url(vendor['phone'], message) if vendor else None
+        })
+    return sections
+
 # ============================================
 # SESSION STATE
 # ============================================
@@ -319,6 +2443,7 @@ if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
     st.session_state.user_name = ""
     st.session_state.user_role = ""
+    st.session_state.outlet = DEFAULT_OUTLET
 
 # ============================================
 # LOGIN SCREEN
@@ -337,6 +2462,7 @@ def login_screen():
     with st.form("login_form"):
         name = st.text_input("Your Name", placeholder="Enter your name")
         role = st.selectbox("Your Role", ["Staff", "Owner"])
+        outlet = st.selectbox("Outlet", OUTLETS) if len(OUTLETS) > 1 else DEFAULT_OUTLET
         
         submitted = st.form_submit_button("Login", use_container_width=True, type="primary")
         
@@ -345,6 +2471,7 @@ def login_screen():
                 st.session_state.logged_in = True
                 st.session_state.user_name = name.strip()
                 st.session_state.user_role = role
+                st.session_state.outlet = outlet
                 st.success(f"✅ Welcome, {name}!")
                 st.rerun()
             else:
@@ -488,30 +2615,12 @@ def add_items_screen():
     col1, col2 = st.columns(2)
     
     with col1:
-        if st.button("➕ Add All Items", type="primary", use_container_width=True):
-            if not bulk_items or not bulk_items.strip():
-                st.error("❌ Please enter at least one item")
-            else:
-                lines = bulk_items.strip().split('\n')
-                added_count = 0
-                
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    # Parse line
-                    if ',' in line:
-                        parts = line.split(',', 1)
-                        item_name = parts[0].strip()
-                        quantity = parts[1].strip() if len(parts) > 1 else ""
-                    else:
-                        item_name = line.strip()
-                        quantity = ""
-                    
-                    if item_name:
-                        draft_manager.add_item(item_name, quantity, added_by)
-                        added_count += 1
+        if st.button("➕ Add All Items", type="primary", use_container_width=True):
+            if not bulk_items or not bulk_items.strip():
+                st.error("❌ Please enter at least one item")
+            else:
+                categories = draft_manager.add_items(parse_bulk_items(bulk_items), added_by)
+                added_count = len(categories)
                 
                 if added_count > 0:
                     st.success(f"✅ Added {added_count} items to draft!")
@@ -539,13 +2648,225 @@ def add_items_screen():
                     st.success(f"✅ {item_name} added!")
                     st.rerun()
 # ============================================
+# LOCAL DRAFT STATE
+# ============================================
+
+def load_draft_view():
+    """Read the draft once per full run and keep it for the screen's fragments.
+    
+    Item edits made inside a fragment are written through draft_manager and
+    then applied to this copy, so only that fragment has to rerun. The next
+    full run replaces the copy with fresh data.
+    """
+    draft = draft_manager.get_draft()
+    st.session_state.draft_view = draft
+    return draft
+
+def draft_categories(items):
+    """Categories in first-seen order."""
+    return list(dict.fromkeys(item['category'] for item in items))
+
+def added_by_caption(item):
+    """'Added by' line; merged lines show how much each person asked for."""
+    contributions = item.get('contributions') or []
+    if len(contributions) < 2:
+        caption = f"Added by {item['added_by']}"
+    else:
+        unit = item['quantity_unit']
+        caption = "Added by " + ", ".join(
+            f"{contribution['added_by']} ({format_quantity(contribution['quantity_value'], unit)})"
+            for contribution in contributions
+        )
+    if item.get('pending_sync'):
+        caption += " · ⏳ not synced yet"
+    return caption
+
+def draft_view_items(category):
+    return [item for item in st.session_state.draft_view.get('items', []) if item['category'] == category]
+
+def remove_item_locally(item_id):
+    draft = st.session_state.draft_view
+    draft['items'] = [item for item in draft.get('items', []) if item['id'] != item_id]
+
+def set_quantity_locally(item_id, quantity):
+    for item in st.session_state.draft_view.get('items', []):
+        if item['id'] == item_id:
+            item['quantity'] = quantity.strip()
+            item.update(quantity_fields(parse_quantity(quantity.strip())))
+            item.pop('contributions', None)
+
+# ============================================
+# TABLE MODE
+# ============================================
+
+# Lists longer than this open as a paged table instead of one widget row per entry
+TABLE_MODE_THRESHOLD = 50
+TABLE_PAGE_SIZE = 50
+
+def table_mode_toggle(row_count, key):
+    return st.toggle("📊 Table mode", value=row_count > TABLE_MODE_THRESHOLD, key=key)
+
+def search_rows(rows, query, field):
+    query = query.lower().strip()
+    if not query:
+        return rows
+    return [row for row in rows if query in row[field].lower()]
+
+def paginate_rows(rows, key):
+    """Return the current page of rows, with a page picker when there is more than one.
+    
+    Only the page is sent to the browser, so the editor stays fast however
+    long the list gets.
+    """
+    pages = max(1, -(-len(rows) // TABLE_PAGE_SIZE))
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=key)
+    start = (page - 1) * TABLE_PAGE_SIZE
+    st.caption(f"Showing {start + 1 if rows else 0}-{min(start + TABLE_PAGE_SIZE, len(rows))} of {len(rows)}")
+    return rows[start:start + TABLE_PAGE_SIZE]
+
+def editor_key(name):
+    """Widget key for a data editor; bumping its generation drops pending edits."""
+    return f"{name}_{st.session_state.get(f'{name}_generation', 0)}"
+
+def reset_editor(name):
+    st.session_state[f"{name}_generation"] = st.session_state.get(f"{name}_generation", 0) + 1
+
+@st.fragment
+def review_table(items):
+    """Paged, searchable editor for the draft; all edits are saved in one write."""
+    query = st.text_input("🔍 Search items", key="review_table_search")
+    rows = paginate_rows(search_rows(items, query, 'name'), key="review_table_page")
+    
+    category_options = sorted(set(get_keywords()) | {'Uncategorized'} | {row['category'] for row in rows})
+    edited = st.data_editor(
+        {
+            "id": [row['id'] for row in rows],
+            "name": [row['name'] for row in rows],
+            "quantity": [row['quantity'] for row in rows],
+            "category": [row['category'] for row in rows],
+            "added_by": [row['added_by'] for row in rows],
+            "delete": [False] * len(rows),
+        },
+        column_config={
+            "id": None,
+            "name": st.column_config.TextColumn("Item", disabled=True),
+            "quantity": st.column_config.TextColumn("Quantity", required=True),
+            "category": st.column_config.SelectboxColumn("Category", options=category_options, required=True),
+            "added_by": st.column_config.TextColumn("Added by", disabled=True),
+            "delete": st.column_config.CheckboxColumn("🗑️ Delete"),
+        },
+        num_rows="fixed",
+        hide_index=True,
+        use_container_width=True,
+        key=editor_key("review_table_editor"),
+    )
+    
+    quantities = {}
+    categories = {}
+    removals = []
+    for row, quantity, category, delete in zip(rows, edited["quantity"], edited["category"], edited["delete"]):
+        if delete:
+            removals.append(row['id'])
+            continue
+        if quantity and quantity.strip() != row['quantity']:
+            quantities[row['id']] = quantity
+        if category != row['category']:
+            categories[row['id']] = category
+    
+    pending = len(quantities.keys() | categories.keys()) + len(removals)
+    if st.button(f"💾 Apply {pending} change(s)", disabled=pending == 0, type="primary", key="review_table_apply"):
+        changed = draft_manager.apply_item_edits(quantities, categories, removals)
+        names = {row['id']: row['name'] for row in rows}
+        learn_corrections([(names[item_id], category) for item_id, category in categories.items()])
+        reset_editor("review_table_editor")
+        st.toast(f"✅ {changed} item(s) updated")
+        st.rerun()
+
+@st.fragment
+def categories_table():
+    """Paged, searchable editor for all keywords; moves and deletes apply together."""
+    rows = [
+        {'keyword': keyword, 'category': category}
+        for category, keywords in get_keywords().items()
+        for keyword in keywords
+    ]
+    query = st.text_input("🔍 Search keywords", key="categories_table_search")
+    rows = paginate_rows(search_rows(rows, query, 'keyword'), key="categories_table_page")
+    
+    edited = st.data_editor(
+        {
+            "keyword": [row['keyword'] for row in rows],
+            "category": [row['category'] for row in rows],
+            "delete": [False] * len(rows),
+        },
+        column_config={
+            "keyword": st.column_config.TextColumn("Keyword", disabled=True),
+            "category": st.column_config.SelectboxColumn("Category", options=list(get_keywords()), required=True),
+            "delete": st.column_config.CheckboxColumn("🗑️ Delete"),
+        },
+        num_rows="fixed",
+        hide_index=True,
+        use_container_width=True,
+        key=editor_key("categories_table_editor"),
+    )
+    
+    removals = []
+    moves = []
+    for row, category, delete in zip(rows, edited["category"], edited["delete"]):
+        if delete:
+            removals.append((row['category'], row['keyword']))
+        elif category != row['category']:
+            moves.append((row['keyword'], row['category'], category))
+    
+    pending = len(removals) + len(moves)
+    if st.button(f"💾 Apply {pending} change(s)", disabled=pending == 0, type="primary", key="categories_table_apply"):
+        changed = apply_keyword_edits(removals, moves)
+        reset_editor("categories_table_editor")
+        st.toast(f"✅ {changed} keyword(s) updated")
+        st.rerun()
+
+# ============================================
 # VIEW DRAFT SCREEN
 # ============================================
 
+@st.fragment
+def draft_category_section(category, editable):
+    """One category's items; deleting an item reruns only this section."""
+    cat_items = draft_view_items(category)
+    if not cat_items:
+        return
+    
+    icon = "⚠️" if category == "Uncategorized" else "✅"
+    
+    with st.expander(f"{icon} {category} ({len(cat_items)} items)", expanded=True):
+        for item in cat_items:
+            col1, col2, col3 = st.columns([4, 2, 1])
+            
+            with col1:
+                st.markdown(f"**{item['name']}**")
+                st.caption(added_by_caption(item))
+            
+            with col2:
+                st.write(f"{item['quantity']}")
+            
+            with col3:
+                if editable:
+                    if st.button("🗑️", key=f"del_{item['id']}"):
+                        draft_manager.remove_item(item['id'])
+                        remove_item_locally(item['id'])
+                        st.rerun(scope="fragment")
+            
+            st.markdown("---")
+
 def view_draft_screen():
     st.title("📋 Current Draft")
     
-    draft = draft_manager.get_draft()
+    draft = load_draft_view()
     items = draft.get('items', [])
     status = draft.get('status', 'Draft')
     
@@ -565,36 +2886,8 @@ def view_draft_screen():
             st.rerun()
         return
     
-    by_category = {}
-    for item in items:
-        cat = item['category']
-        if cat not in by_category:
-            by_category[cat] = []
-        by_category[cat].append(item)
-    
-    for category, cat_items in by_category.items():
-        icon = "⚠️" if category == "Uncategorized" else "✅"
-        
-        with st.expander(f"{icon} {category} ({len(cat_items)} items)", expanded=True):
-            for item in cat_items:
-                idx = items.index(item)
-                
-                col1, col2, col3 = st.columns([4, 2, 1])
-                
-                with col1:
-                    st.markdown(f"**{item['name']}**")
-                    st.caption(f"Added by {item['added_by']}")
-                
-                with col2:
-                    st.write(f"{item['quantity']}")
-                
-                with col3:
-                    if status == "Draft":
-                        if st.button("🗑️", key=f"del_{idx}"):
-                            draft_manager.remove_item(idx)
-                            st.rerun()
-                
-                st.markdown("---")
+    for category in draft_categories(items):
+        draft_category_section(category, editable=status == "Draft")
     
     st.markdown("---")
     
@@ -616,6 +2909,53 @@ def view_draft_screen():
 # REVIEW SCREEN
 # ============================================
 
+@st.fragment
+def review_category_section(category):
+    """One category's editable items; saves and deletes rerun only this section."""
+    cat_items = draft_view_items(category)
+    if not cat_items:
+        return
+    
+    icon = "⚠️" if category == "Uncategorized" else "✅"
+    
+    with st.expander(f"{icon} {category} ({len(cat_items)} items)", expanded=True):
+        for item in cat_items:
+            item_id = item['id']
+            
+            col1, col2, col3 = st.columns([3, 2, 1])
+            
+            with col1:
+                st.write(f"**{item['name']}**")
+                caption = added_by_caption(item)
+                if 'category_confidence' in item:
+                    caption += f" · 🤖 guessed ({item['category_confidence']:.0%} sure)"
+                st.caption(caption)
+            
+            with col2:
+                # Editable quantity
+                new_quantity = st.text_input(
+                    "Quantity",
+                    value=item['quantity'],
+                    key=f"qty_{item_id}",
+                    label_visibility="collapsed"
+                )
+                
+                if new_quantity != item['quantity']:
+                    if st.button("💾 Save", key=f"save_{item_id}"):
+                        if not draft_manager.update_item_quantity(item_id, new_quantity):
+                            # Removed by someone else; resync the whole screen
+                            st.rerun()
+                        set_quantity_locally(item_id, new_quantity)
+                        st.toast("✅ Quantity updated")
+                        st.rerun(scope="fragment")
+            
+            with col3:
+                if st.button("🗑️", key=f"del_review_{item_id}"):
+                    draft_manager.remove_item(item_id)
+                    remove_item_locally(item_id)
+                    st.toast("✅ Item removed")
+                    st.rerun(scope="fragment")
+
 def review_screen():
     st.title("✅ Review & Approve Draft")
     
@@ -626,7 +2966,7 @@ def review_screen():
             st.rerun()
         return
     
-    draft = draft_manager.get_draft()
+    draft = load_draft_view()
     items = draft.get('items', [])
     status = draft.get('status', 'Draft')
     
@@ -658,55 +2998,13 @@ def review_screen():
     
     st.markdown("---")
     
-    by_category = {}
-    for item in items:
-        cat = item['category']
-        if cat not in by_category:
-            by_category[cat] = []
-        by_category[cat].append(item)
-    
     st.subheader("Items by Category")
     
-    for category, cat_items in by_category.items():
-        icon = "⚠️" if category == "Uncategorized" else "✅"
-        
-        with st.expander(f"{icon} {category} ({len(cat_items)} items)", expanded=True):
-            for item in cat_items:
-                # Find item index in full items list
-                item_idx = items.index(item)
-                
-                col1, col2, col3 = st.columns([3, 2, 1])
-                
-                with col1:
-                    st.write(f"**{item['name']}**")
-                    st.caption(f"Added by {item['added_by']}")
-                
-                with col2:
-                    # Editable quantity
-                    new_quantity = st.text_input(
-                        "Quantity",
-                        value=item['quantity'],
-                        key=f"qty_{item_idx}",
-                        label_visibility="collapsed"
-                    )
-                    
-                    if new_quantity != item['quantity']:
-                        if st.button("💾 Save", key=f"save_{item_idx}"):
-                            draft = draft_manager.get_draft()
-                            all_items = draft.get('items', [])
-                            all_items[item_idx]['quantity'] = new_quantity
-                            draft_manager.draft_ref.update({'items': all_items})
-                            st.success("✅ Quantity updated")
-                            st.rerun()
-                
-                with col3:
-                    if st.button("🗑️", key=f"del_review_{item_idx}"):
-                        draft = draft_manager.get_draft()
-                        all_items = draft.get('items', [])
-                        all_items.pop(item_idx)
-                        draft_manager.draft_ref.update({'items': all_items})
-                        st.success("✅ Item removed")
-                        st.rerun()
+    if table_mode_toggle(len(items), key="review_table_mode"):
+        review_table(items)
+    else:
+        for category in draft_categories(items):
+            review_category_section(category)
     
     st.markdown("---")
     
@@ -716,7 +3014,7 @@ def review_screen():
         
         uncategorized_items = [item for item in items if item['category'] == 'Uncategorized']
         
-        for idx, item in enumerate(uncategorized_items):
+        for item in uncategorized_items:
             with st.expander(f"Fix: {item['name']}", expanded=True):
                 st.write(f"**Item:** {item['name']}")
                 st.write(f"**Quantity:** {item['quantity']}")
@@ -725,26 +3023,20 @@ def review_screen():
                 
                 with col1:
                     st.markdown("**Option 1: Add to Existing Category**")
-                    existing_categories = list(KEYWORDS_DATABASE.keys())
+                    existing_categories = list(get_keywords().keys())
                     selected_category = st.selectbox(
                         "Choose Category",
                         existing_categories,
-                        key=f"cat_select_{idx}"
+                        key=f"cat_select_{item['id']}"
                     )
                     
-                    if st.button("Add to Category", key=f"add_existing_{idx}"):
+                    if st.button("Add to Category", key=f"add_existing_{item['id']}"):
                         # Add item keyword to category
                         add_item_to_category(selected_category, item['name'])
                         
                         # Re-categorize the item in draft
-                        draft = draft_manager.get_draft()
-                        all_items = draft.get('items', [])
-                        
-                        for draft_item in all_items:
-                            if draft_item['name'] == item['name'] and draft_item['category'] == 'Uncategorized':
-                                draft_item['category'] = selected_category
-                        
-                        draft_manager.draft_ref.update({'items': all_items})
+                        draft_manager.recategorize_items(item['name'], selected_category)
+                        learn_corrections([(item['name'], selected_category)])
                         st.success(f"✅ {item['name']} added to {selected_category}")
                         st.rerun()
                 
@@ -753,24 +3045,18 @@ def review_screen():
                     new_category_name = st.text_input(
                         "New Category Name",
                         placeholder="e.g., Frozen Foods",
-                        key=f"new_cat_{idx}"
+                        key=f"new_cat_{item['id']}"
                     )
                     
-                    if st.button("Create Category", key=f"create_new_{idx}"):
+                    if st.button("Create Category", key=f"create_new_{item['id']}"):
                         if new_category_name and new_category_name.strip():
                             # Create new category with this item
                             item_lower = item['name'].lower().strip()
                             add_new_category(new_category_name.strip(), [item_lower])
                             
                             # Re-categorize the item in draft
-                            draft = draft_manager.get_draft()
-                            all_items = draft.get('items', [])
-                            
-                            for draft_item in all_items:
-                                if draft_item['name'] == item['name'] and draft_item['category'] == 'Uncategorized':
-                                    draft_item['category'] = new_category_name.strip()
-                            
-                            draft_manager.draft_ref.update({'items': all_items})
+                            draft_manager.recategorize_items(item['name'], new_category_name.strip())
+                            learn_corrections([(item['name'], new_category_name.strip())])
                             st.success(f"✅ Created category '{new_category_name}' with {item['name']}")
                             st.rerun()
                         else:
@@ -800,6 +3086,55 @@ def review_screen():
 # VENDORS SCREEN
 # ============================================
 
+TEMPLATE_PREVIEW_ITEMS = [
+    {"name": "Tomato", "quantity": "2kg", "quantity_value": 2.0, "quantity_unit": "kg", "category": "Vegetables"},
+    {"name": "Milk", "quantity": "500 ml", "quantity_value": 0.5, "quantity_unit": "l", "category": "Dairy & Milk Products"},
+    {"name": "Coriander", "quantity": "", "quantity_value": None, "quantity_unit": None, "category": "Vegetables"}
+]
+
+def vendor_template_form(vendor):
+    """Edit a vendor's message template; saved templates are previewed below the form."""
+    spec = vendor.get('template') or {}
+    languages = list(MESSAGE_LANGUAGES)
+    
+    with st.form(f"template_{vendor['id']}"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            language_index = languages.index(spec['language']) if spec.get('language') in languages else 0
+            language = st.selectbox("Language", languages, index=language_index)
+        
+        with col2:
+            delivery_days = st.number_input("Delivery in (days)", min_value=0, max_value=14,
+                                            value=int(spec.get('delivery_days', 1)))
+        
+        wording = MESSAGE_LANGUAGES[language]
+        greeting = st.text_input("Greeting", value=spec.get('greeting', ''), placeholder=wording['greeting'])
+        intro = st.text_input("Intro", value=spec.get('intro', ''), placeholder=wording['intro'])
+        item = st.text_input(
+            "Item line", value=spec.get('item', ''), placeholder=DEFAULT_ITEM_FORMAT,
+            help="Placeholders: {name}, {quantity}, {units} (e.g. 0.5 kg), {category}"
+        )
+        closing = st.text_input("Closing", value=spec.get('closing', ''), placeholder=wording['closing'])
+        
+        if st.form_submit_button("💾 Save Template", use_container_width=True):
+            new_spec = {'language': language, 'delivery_days': int(delivery_days)}
+            for field, value in (('greeting', greeting), ('intro', intro), ('item', item), ('closing', closing)):
+                if value.strip():
+                    new_spec[field] = value.strip()
+            try:
+                MessageTemplate(new_spec)
+            except ValueError as error:
+                st.error(f"❌ {error}")
+            else:
+                vendor_manager.update_vendor(vendor['id'], {'template': new_spec})
+                st.success("✅ Template saved")
+                st.rerun()
+    
+    preview = vendor_manager.get_template(vendor).render(vendor['vendor_name'], TEMPLATE_PREVIEW_ITEMS, vendor['category'])
+    st.markdown("**Message Preview:**")
+    st.markdown(f'<div class="whatsapp-message">{preview}</div>', unsafe_allow_html=True)
+
 def vendors_screen():
     st.title("👥 Vendor Management")
     
@@ -818,7 +3153,7 @@ def vendors_screen():
         col1, col2 = st.columns(2)
         
         with col1:
-            categories = list(KEYWORDS_DATABASE.keys())
+            categories = list(get_keywords().keys())
             category = st.selectbox("Category", categories)
         
         with col2:
@@ -862,7 +3197,7 @@ def vendors_screen():
                     new_name = st.text_input("Vendor Name", value=vendor['vendor_name'])
                     new_phone = st.text_input("Phone Number", value=vendor['phone'])
                     
-                    categories = list(KEYWORDS_DATABASE.keys())
+                    categories = list(get_keywords().keys())
                     current_cat_index = categories.index(vendor['category']) if vendor['category'] in categories else 0
                     new_category = st.selectbox("Category", categories, index=current_cat_index)
                     
@@ -871,7 +3206,7 @@ def vendors_screen():
                     with col1:
                         if st.form_submit_button("💾 Save Changes", use_container_width=True):
                             # Update vendor
-                            vendor_manager.vendors_ref.document(vendor['id']).update({
+                            vendor_manager.update_vendor(vendor['id'], {
                                 'vendor_name': new_name,
                                 'phone': new_phone,
                                 'category': new_category
@@ -884,11 +3219,71 @@ def vendors_screen():
                             vendor_manager.delete_vendor(vendor['id'])
                             st.success("✅ Vendor deleted")
                             st.rerun()
+                
+                st.markdown("---")
+                
+                st.markdown("**Message Template:**")
+                vendor_template_form(vendor)
 
 # ============================================
 # SEND ORDERS SCREEN
 # ============================================
 
+def send_bundle(draft):
+    """prepare_send_bundle() for the draft, reused until the draft or the vendors change.
+    
+    Keyed on the live draft version (plus queued writes) and the vendor
+    index version, so rerunning or reopening the send screen rebuilds
+    nothing. Without a live draft version the bundle is rebuilt each run.
+    """
+    version = draft_manager.get_draft_version()
+    # The day is part of the key because templates can name the delivery date
+    key = (
+        current_outlet(), version, draft.get('pending_writes', 0),
+        vendor_manager.index_version(), datetime.now().date()
+    )
+    cached = st.session_state.get('send_bundle')
+    if version is not None and cached is not None and cached[0] == key:
+        return cached[1]
+    
+    bundle = prepare_send_bundle(draft.get('items', []))
+    st.session_state.send_bundle = (key, bundle)
+    return bundle
+
+@st.fragment
+def vendor_preview_section(section):
+    """Message preview for one vendor; ticking it off reruns only this section."""
+    category = section['category']
+    st.subheader(f"{category} ({len(section['items'])} items)")
+    
+    vendor = section['vendor']
+    
+    if not vendor:
+        st.warning(f"⚠️ No vendor mapped for {category}")
+        st.caption("Go to 'Vendors' to add one")
+        st.markdown("---")
+        return
+    
+    message = section['message']
+    
+    st.markdown("**Message Preview:**")
+    st.markdown(f'<div class="whatsapp-message">{message}</div>', unsafe_allow_html=True)
+    
+    whatsapp_url = section['url']
+    
+    col1, col2, col3 = st.columns([3, 1, 1])
+    
+    with col1:
+        st.write(f"**Sending to:** {vendor['vendor_name']} ({vendor['phone']})")
+    
+    with col2:
+        st.link_button("📱 Send via WhatsApp", whatsapp_url, use_container_width=True)
+    
+    with col3:
+        st.checkbox("Messaged", key=f"messaged_{category}")
+    
+    st.markdown("---")
+
 def send_orders_screen():
     st.title("📤 Send Orders to Vendors")
     
@@ -900,7 +3295,6 @@ def send_orders_screen():
         return
     
     draft = draft_manager.get_draft()
-    items = draft.get('items', [])
     status = draft.get('status', 'Draft')
     
     if status != "Approved":
@@ -910,52 +3304,31 @@ def send_orders_screen():
             st.rerun()
         return
     
-    by_category = {}
-    for item in items:
-        cat = item['category']
-        if cat != 'Uncategorized':
-            if cat not in by_category:
-                by_category[cat] = []
-            by_category[cat].append(item)
+    # This screen's reads from here on are the vendor lookups
+    stats = current_stats()
+    reads_before = stats.screens.get(stats.current_screen, {}).get("reads", 0)
+    sections = send_bundle(draft)
     
-    if len(by_category) == 0:
+    if len(sections) == 0:
         st.warning("No categorized items to send")
         if st.button("← Back"):
             st.session_state.current_page = "home"
             st.rerun()
         return
     
-    st.info(f"📦 {len(by_category)} categories ready to send")
+    st.info(f"📦 {len(sections)} categories ready to send")
     
     st.markdown("---")
     
-    for category, cat_items in by_category.items():
-        st.subheader(f"{category} ({len(cat_items)} items)")
-        
-        vendor = vendor_manager.get_vendor_by_category(category)
-        
-        if not vendor:
-            st.warning(f"⚠️ No vendor mapped for {category}")
-            st.caption("Go to 'Vendors' to add one")
-            st.markdown("---")
-            continue
-        
-        message = generate_whatsapp_message(vendor['vendor_name'], cat_items)
-        
-        st.markdown("**Message Preview:**")
-        st.markdown(f'<div class="whatsapp-message">{message}</div>', unsafe_allow_html=True)
-        
-        whatsapp_url = create_whatsapp_url(vendor['phone'], message)
-        
-        col1, col2 = st.columns([3, 1])
-        
-        with col1:
-            st.write(f"**Sending to:** {vendor['vendor_name']} ({vendor['phone']})")
-        
-        with col2:
-            st.link_button("📱 Send via WhatsApp", whatsapp_url, use_container_width=True)
-        
-        st.markdown("---")
+    for section in sections:
+        vendor_preview_section(section)
+    
+    # Without the vendor index this screen ran one query per category
+    vendor_reads = stats.screens.get(stats.current_screen, {}).get("reads", 0) - reads_before
+    st.caption(
+        f"🔎 Vendor reads this run: {vendor_reads} "
+        f"(uncached: {len(sections)} queries)"
+    )
     
     st.subheader("After Sending All Messages")
     
@@ -978,10 +3351,57 @@ def send_orders_screen():
 # ORDER HISTORY SCREEN
 # ============================================
 
+HISTORY_PAGE_SIZE = 10
+# download_button keeps its whole payload in memory (and in the browser
+# session), so larger exports are left to the order_export.py CLI
+EXPORT_SCREEN_MAX_BYTES = 50 * 1024 * 1024
+
+def load_history_page(history):
+    """Append the next page of orders to the session's history cache."""
+    _, start, end, sent_by = history['filters']
+    orders, cursor = draft_manager.get_order_page(
+        page_size=HISTORY_PAGE_SIZE,
+        cursor=history['cursor'],
+        start=start,
+        end=end,
+        sent_by=sent_by or None
+    )
+    history['orders'].extend(orders)
+    history['cursor'] = cursor
+    history['done'] = cursor is None
+
 def history_screen():
     st.title("📜 Order History")
     
-    orders = draft_manager.get_order_history(limit=10)
+    col1, col2, col3 = st.columns([2, 2, 1])
+    
+    with col1:
+        date_range = st.date_input("Sent between", value=(), key="history_dates")
+    
+    with col2:
+        sender = st.text_input("Sent by", key="history_sender", placeholder="Anyone")
+    
+    start = end = None
+    if len(date_range) >= 1:
+        start = datetime.combine(date_range[0], datetime.min.time(), tzinfo=timezone.utc)
+    if len(date_range) == 2:
+        end = datetime.combine(date_range[1] + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    
+    # The outlet is part of the key so a re-login elsewhere starts a fresh history
+    filters = (current_outlet(), start, end, sender.strip())
+    
+    with col3:
+        st.write("")
+        refresh = st.button("🔄 Refresh", use_container_width=True)
+    
+    # Pages already loaded this session are kept until the filters change
+    history = st.session_state.get('history')
+    if refresh or history is None or history['filters'] != filters:
+        history = {'filters': filters, 'orders': [], 'cursor': None, 'done': False, 'bodies': {}}
+        st.session_state.history = history
+        load_history_page(history)
+    
+    orders = history['orders']
     
     if len(orders) == 0:
         st.info("No orders sent yet")
@@ -990,18 +3410,27 @@ def history_screen():
             st.rerun()
         return
     
-    st.write(f"Showing last {len(orders)} orders")
+    st.write(f"Showing {len(orders)} orders")
     
     for order in orders:
         with st.expander(f"📦 Order - {order.get('sent_at', 'Unknown date')}", expanded=False):
-            items = order.get('items', [])
-            
-            st.write(f"**Total Items:** {len(items)}")
+            st.write(f"**Total Items:** {order.get('item_count', '—')}")
             st.write(f"**Sent by:** {order.get('sent_by', 'Unknown')}")
             st.write(f"**Approved by:** {order.get('approved_by', 'Unknown')}")
             
             st.markdown("---")
             
+            body = history['bodies'].get(order['id'])
+            if body is None:
+                if st.button("Show items", key=f"load_order_{order['id']}"):
+                    body = draft_manager.get_order(order['id']) or {}
+                    history['bodies'][order['id']] = body
+            
+            if body is None:
+                continue
+            
+            items = body.get('items', [])
+            
             by_category = {}
             for item in items:
                 cat = item['category']
@@ -1013,6 +3442,104 @@ def history_screen():
                 st.write(f"**{category}:**")
                 for item in cat_items:
                     st.write(f"  • {item['name']} - {item['quantity']}")
+    
+    if not history['done']:
+        if st.button("⬇️ Load more", use_container_width=True):
+            load_history_page(history)
+            st.rerun()
+    
+    st.markdown("---")
+    
+    with st.expander("📥 Export History", expanded=False):
+        st.caption("One row per ordered item, for spreadsheets and BI tools. Uses the date filter above.")
+        export_format = st.selectbox("Format", ["csv", "parquet"], key="export_format")
+        
+        if st.button("Prepare Export", use_container_width=True):
+            mime, extension = FORMATS[export_format]
+            try:
+                # Orders stream page by page into a temp file; only the finished
+                # file is read back, because download_button needs the bytes
+                with tempfile.TemporaryFile() as export_file:
+                    count = export_orders(draft_manager.orders_ref, export_file, export_format, start=start, end=end)
+                    size = export_file.tell()
+                    export_file.seek(0)
+                    data = export_file.read() if size <= EXPORT_SCREEN_MAX_BYTES else None
+                if data is None:
+                    st.warning(
+                        f"⚠️ {count} rows is too large to download here "
+                        f"({size / 1024 / 1024:.0f} MB). Narrow the date range, or run "
+                        f"`python order_export.py --outlet {current_outlet()} --format {export_format} "
+                        f"--output orders.{extension}`."
+                    )
+                else:
+                    st.download_button(
+                        f"⬇️ Download {count} rows",
+                        data=data,
+                        file_name=f"orderflow-orders.{extension}",
+                        mime=mime,
+                        use_container_width=True
+                    )
+            except RuntimeError as error:
+                st.error(f"❌ {error}")
+
+# ============================================
+# ANALYTICS SCREEN
+# ============================================
+
+def analytics_screen():
+    st.title("📊 Order Analytics")
+    
+    if st.session_state.user_role != "Owner":
+        st.error("❌ Only owners can view analytics")
+        if st.button("← Back"):
+            st.session_state.current_page = "home"
+            st.rerun()
+        return
+    
+    analytics = draft_manager.analytics
+    # Finishes oversized orders whose rollups did not land right after sending
+    get_rollup_repairer(current_outlet())
+    daily = analytics.get_daily(days=30)
+    
+    if len(daily) == 0:
+        st.info("No analytics yet. Send an order or rebuild from history below.")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Orders (30 days)", sum(day.get('order_count', 0) for day in daily))
+        with col2:
+            st.metric("Items (30 days)", sum(day.get('item_count', 0) for day in daily))
+        with col3:
+            st.metric("Active days", len(daily))
+        
+        st.subheader("Items per Day")
+        chart_rows = [{"date": day['date'], "items": day.get('item_count', 0)} for day in reversed(daily)]
+        st.bar_chart(chart_rows, x="date", y="items")
+        
+        st.markdown("---")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.subheader("By Category")
+            for entry in analytics.get_categories():
+                st.write(f"**{entry['category']}:** {entry.get('item_count', 0)} items in {entry.get('order_count', 0)} orders")
+        
+        with col2:
+            st.subheader("Most Ordered Items")
+            for entry in analytics.get_top_items(limit=20):
+                totals = ", ".join(format_quantity(total, unit) for unit, total in entry.get('quantities', {}).items())
+                st.write(f"• {entry['name']} - {entry.get('count', 0)} times" + (f" ({totals})" if totals else ""))
+    
+    st.markdown("---")
+    
+    with st.expander("🔧 Rebuild from Order History", expanded=False):
+        st.caption("Recomputes every rollup from the orders collection. Run it when nobody is sending orders.")
+        if st.button("Rebuild Analytics", use_container_width=True):
+            with st.spinner("Rebuilding analytics..."):
+                processed = analytics.rebuild_rollups()
+            st.success(f"✅ Rebuilt analytics from {processed} orders")
+            st.rerun()
 
 # ============================================
 # CATEGORY MANAGEMENT SCREEN
@@ -1030,9 +3557,13 @@ def categories_screen():
     
     st.subheader("All Categories & Items")
     
+    keyword_count = sum(len(keywords) for keywords in get_keywords().values())
+    table_mode = table_mode_toggle(keyword_count, key="categories_table_mode")
+    if table_mode:
+        categories_table()
+    
     # Display all categories
-    # Display all categories
-    for category, keywords in KEYWORDS_DATABASE.items():
+    for category, keywords in get_keywords().items():
         with st.expander(f"📁 {category} ({len(keywords)} items)", expanded=False):
             
             # Display items with delete buttons
@@ -1040,6 +3571,8 @@ def categories_screen():
             
             if len(keywords) == 0:
                 st.info("No items in this category yet")
+            elif table_mode:
+                st.caption(", ".join(keywords))
             else:
                 # Show items in a grid
                 cols_per_row = 3
@@ -1054,7 +3587,7 @@ def categories_screen():
                                 st.write(f"• {item}")
                             with col2:
                                 if st.button("🗑️", key=f"del_{category}_{item}"):
-                                    KEYWORDS_DATABASE[category].remove(item)
+                                    remove_item_from_category(category, item)
                                     st.success(f"✅ Deleted '{item}'")
                                     st.rerun()
             
@@ -1068,7 +3601,7 @@ def categories_screen():
                     if new_item and new_item.strip():
                         item_lower = new_item.lower().strip()
                         if item_lower not in keywords:
-                            KEYWORDS_DATABASE[category].append(item_lower)
+                            add_item_to_category(category, item_lower)
                             st.success(f"✅ Added '{new_item}' to {category}")
                             st.rerun()
                         else:
@@ -1087,9 +3620,9 @@ def categories_screen():
         
         if st.form_submit_button("Create Category"):
             if new_cat_name and new_cat_name.strip():
-                if new_cat_name.strip() not in KEYWORDS_DATABASE:
+                if new_cat_name.strip() not in get_keywords():
                     keywords_list = [first_item.lower().strip()] if first_item else []
-                    KEYWORDS_DATABASE[new_cat_name.strip()] = keywords_list
+                    add_new_category(new_cat_name.strip(), keywords_list)
                     st.success(f"✅ Created category '{new_cat_name}'")
                     st.rerun()
                 else:
@@ -1108,31 +3641,25 @@ def categories_screen():
         with col1:
             # Get all items from all categories
             all_items = []
-            for cat, items in KEYWORDS_DATABASE.items():
+            for cat, items in get_keywords().items():
                 for item in items:
                     all_items.append(f"{item} ({cat})")
             
             selected_item = st.selectbox("Select Item", sorted(all_items))
         
         with col2:
-            from_category = st.selectbox("From Category", list(KEYWORDS_DATABASE.keys()))
+            from_category = st.selectbox("From Category", list(get_keywords().keys()))
         
         with col3:
-            to_category = st.selectbox("To Category", list(KEYWORDS_DATABASE.keys()))
+            to_category = st.selectbox("To Category", list(get_keywords().keys()))
         
         if st.form_submit_button("Move Item"):
             if from_category != to_category:
                 # Extract item name
                 item_name = selected_item.split(" (")[0]
                 
-                # Remove from old category
-                if item_name in KEYWORDS_DATABASE[from_category]:
-                    KEYWORDS_DATABASE[from_category].remove(item_name)
-                    
-                    # Add to new category
-                    if item_name not in KEYWORDS_DATABASE[to_category]:
-                        KEYWORDS_DATABASE[to_category].append(item_name)
-                    
+                # Remove from old category and add to new category
+                if move_item_between_categories(item_name, from_category, to_category):
                     st.success(f"✅ Moved '{item_name}' from {from_category} to {to_category}")
                     st.rerun()
                 else:
@@ -1143,17 +3670,124 @@ def categories_screen():
 # MAIN APP
 # ============================================
 
+# The live draft copy makes the menu's periodic refresh free of reads
+OWNER_MENU_REFRESH_SECONDS = 30 if LIVE_LISTENERS else None
+
+def data_access_panel(stats):
+    """Owner-only sidebar panel with storage reads, writes and latency per screen, plus the categorization cache."""
+    with st.expander("🔧 Data Access", expanded=False):
+        totals = stats.totals
+        st.caption(
+            f"This run: {totals['reads']} reads · {totals['writes']} writes · "
+            f"{totals['calls']} calls · {totals['data_ms']:.0f} ms in storage"
+        )
+        st.dataframe(
+            [{"screen": name, **counters} for name, counters in stats.screens.items()],
+            hide_index=True,
+            use_container_width=True,
+        )
+        
+        previous = st.session_state.get('last_rerun_stats')
+        if previous:
+            totals = previous['totals']
+            st.caption(
+                f"Previous run ({previous['label']}): {totals['reads']} reads · {totals['writes']} writes · "
+                f"{totals['data_ms']:.0f} ms in storage · {totals['wall_ms']:.0f} ms total"
+            )
+            for name, elapsed_ms in previous.get('marks', {}).items():
+                st.caption(f"{name.replace('_', ' ').capitalize()}: {elapsed_ms:.0f} ms after script start")
+        
+        background = background_stats.totals
+        st.caption(f"Listeners since start: {background['reads']} reads")
+        
+        cache = categorize_cache_stats()
+        st.caption(
+            f"Categorization cache: {cache['hits']} hits · {cache['misses']} misses · "
+            f"{cache['size']}/{cache['max_size']} names"
+        )
+
+# Only reads the local queue file, so frequent refreshes are cheap
+SYNC_STATUS_REFRESH_SECONDS = 5
+
+@st.fragment(run_every=SYNC_STATUS_REFRESH_SECONDS)
+def sync_status(worker):
+    """Sidebar line saying whether this outlet's queued writes have reached storage."""
+    status = worker.outbox.status(worker.outlet)
+    if status['dead']:
+        st.caption(f"⚠️ {status['dead']} change(s) could not be saved and were set aside")
+    if status['pending'] == 0:
+        st.caption("✅ All changes synced")
+        return
+    
+    waiting = time.time() - status['oldest_pending_at']
+    st.caption(f"⏳ {status['pending']} change(s) waiting to sync ({waiting:.0f}s)")
+    if status['last_error']:
+        st.caption("📡 Can't reach the server, retrying in the background")
+
+@st.fragment(run_every=OWNER_MENU_REFRESH_SECONDS)
+def owner_menu():
+    """Sidebar owner menu.
+    
+    Runs as its own fragment so the Review / Send buttons follow draft
+    changes made by other users without rerunning the open screen.
+    """
+    st.markdown("---")
+    st.caption("Owner Menu")
+    
+    draft = draft_manager.get_draft()
+    status = draft.get('status', 'Draft')
+    items = draft.get('items', [])
+    
+    if len(items) > 0 and status == "Draft":
+        if st.button("✅ Review", use_container_width=True):
+            st.session_state.current_page = "review"
+            st.rerun()
+    
+    if status == "Approved":
+        if st.button("📤 Send Orders", use_container_width=True, type="primary"):
+            st.session_state.current_page = "send_orders"
+            st.rerun()
+    
+    if st.button("👥 Vendors", use_container_width=True):
+        st.session_state.current_page = "vendors"
+        st.rerun()
+    
+    if st.button("📜 History", use_container_width=True):
+        st.session_state.current_page = "history"
+        st.rerun()
+    
+    if st.button("📊 Analytics", use_container_width=True):
+        st.session_state.current_page = "analytics"
+        st.rerun()
+    
+    if st.button("📂 Categories", use_container_width=True):
+        st.session_state.current_page = "categories"
+        st.rerun()
+
 def main():
     if 'current_page' not in st.session_state:
         st.session_state.current_page = "home"
     
+    stats = current_stats()
+    stats.label = st.session_state.current_page if st.session_state.logged_in else "login"
+    try:
+        render_app(stats)
+    finally:
+        # Also runs when a screen calls st.rerun(), so action reruns are logged too
+        stats.finish()
+        st.session_state.last_rerun_stats = stats.as_dict()
+        log_rerun(stats)
+
+def render_app(stats):
     # Check if logged in
     if not st.session_state.logged_in:
-        login_screen()
+        with stats.screen("login"):
+            login_screen()
+        stats.mark("first_paint")
         return
     
     # Sidebar
-    with st.sidebar:
+    with st.sidebar, stats.screen("sidebar"):
         st.title("🛒 OrderFlow")
         
         st.markdown("---")
@@ -1172,40 +3806,16 @@ def main():
         
         # Owner-only buttons
         if st.session_state.user_role == "Owner":
-            st.markdown("---")
-            st.caption("Owner Menu")
-            
-            draft = draft_manager.get_draft()
-            status = draft.get('status', 'Draft')
-            items = draft.get('items', [])
-            
-            if len(items) > 0 and status == "Draft":
-                if st.button("✅ Review", use_container_width=True):
-                    st.session_state.current_page = "review"
-                    st.rerun()
-            
-            if status == "Approved":
-                if st.button("📤 Send Orders", use_container_width=True, type="primary"):
-                    st.session_state.current_page = "send_orders"
-                    st.rerun()
-            
-            if st.button("👥 Vendors", use_container_width=True):
-                st.session_state.current_page = "vendors"
-                st.rerun()
-            
-            if st.button("📜 History", use_container_width=True):
-                st.session_state.current_page = "history"
-                st.rerun()
-
-            if st.button("📂 Categories", use_container_width=True):
-               st.session_state.current_page = "categories"
-               st.rerun()
-
+            owner_menu()
         
         st.markdown("---")
         
         st.caption(f"**{st.session_state.user_name}**")
         st.caption(f"Role: {st.session_state.user_role}")
+        if len(OUTLETS) > 1:
+            st.caption(f"Outlet: {current_outlet()}")
+        if draft_manager.sync is not None:
+            sync_status(draft_manager.sync)
         
         if st.button("🚪 Logout", use_container_width=True):
             st.session_state.logged_in = False
@@ -1213,22 +3823,30 @@ def main():
             st.rerun()
     
     # Route to screens
-    if st.session_state.current_page == "home":
-        home_screen()
-    elif st.session_state.current_page == "add_items":
-        add_items_screen()
-    elif st.session_state.current_page == "view_draft":
-        view_draft_screen()
-    elif st.session_state.current_page == "review":
-        review_screen()
-    elif st.session_state.current_page == "vendors":
-        vendors_screen()
-    elif st.session_state.current_page == "send_orders":
-        send_orders_screen()
-    elif st.session_state.current_page == "history":
-        history_screen()
-    elif st.session_state.current_page == "categories":
-        categories_screen()
+    page = st.session_state.current_page
+    with stats.screen(page):
+        if page == "home":
+            home_screen()
+        elif page == "add_items":
+            add_items_screen()
+        elif page == "view_draft":
+            view_draft_screen()
+        elif page == "review":
+            review_screen()
+        elif page == "vendors":
+            vendors_screen()
+        elif page == "send_orders":
+            send_orders_screen()
+        elif page == "history":
+            history_screen()
+        elif page == "analytics":
+            analytics_screen()
+        elif page == "categories":
+            categories_screen()
+    
+    if st.session_state.user_role == "Owner":
+        with st.sidebar:
+            data_access_panel(stats)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
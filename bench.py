@@ -0,0 +1,299 @@
+"""Benchmarks for the categorization, parsing and messaging hot paths.
+
+Synthetic generators build keyword databases (thousands of keywords over
+dozens of categories) and drafts of 10 to 10,000 items, then time
+categorize_item/categorize_items (including misspelled names that need
+the fuzzy tier), parse_bulk_items, generate_whatsapp_message,
+create_whatsapp_url and prepare_send_bundle. Each case reports
+throughput and per-call latency percentiles.
+
+    python bench.py                          # print results
+    python bench.py --save bench_baseline.json
+    python bench.py --compare bench_baseline.json --tolerance 0.25
+
+--compare exits with status 1 when a case's p50 latency or throughput is
+worse than the baseline by more than the tolerance. Runs use the
+in-memory storage backend, so no Firebase credentials are needed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import time
+
+os.environ.setdefault("ORDERFLOW_STORAGE", "memory")
+
+import app  # noqa: E402
+from category_model import CategoryModel  # noqa: E402
+from docstore import create_store  # noqa: E402
+
+DRAFT_SIZES = [10, 100, 1000, 10000]
+DEFAULT_CATEGORIES = 40
+DEFAULT_KEYWORDS_PER_CATEGORY = 75
+
+# ============================================
+# GENERATORS
+# ============================================
+
+def make_word(rng, min_length=3, max_length=9):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(min_length, max_length)))
+
+def make_keyword_database(rng, categories=DEFAULT_CATEGORIES, keywords_per_category=DEFAULT_KEYWORDS_PER_CATEGORY):
+    database = {}
+    for index in range(categories):
+        keywords = set()
+        while len(keywords) < keywords_per_category:
+            keyword = make_word(rng)
+            if rng.random() < 0.15:
+                keyword = f"{keyword} {make_word(rng)}"
+            keywords.add(keyword)
+        database[f"Category {index:02d}"] = sorted(keywords)
+    return database
+
+def make_item_names(rng, database, count):
+    """Mix of exact keyword hits, names containing a keyword, and misses."""
+    keywords = [keyword for keywords in database.values() for keyword in keywords]
+    names = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.4:
+            names.append(rng.choice(keywords).title())
+        elif roll < 0.8:
+            names.append(f"Fresh {rng.choice(keywords)} {make_word(rng, 2, 5)}")
+        else:
+            names.append(f"{make_word(rng, 6, 12)} {make_word(rng, 6, 12)}")
+    return names
+
+def make_misspellings(rng, database, count):
+    """Keywords with one random typo, so they miss the exact and substring passes."""
+    keywords = [keyword for keywords in database.values() for keyword in keywords if len(keyword) >= 5]
+    names = []
+    for _ in range(count):
+        word = list(rng.choice(keywords))
+        position = rng.randrange(len(word))
+        roll = rng.random()
+        if roll < 0.4:
+            word[position] = rng.choice(string.ascii_lowercase)
+        elif roll < 0.7:
+            del word[position]
+        else:
+            word.insert(position, rng.choice(string.ascii_lowercase))
+        names.append("".join(word))
+    return names
+
+def make_paste(rng, names):
+    units = ["kg", "g", "L", "ml", " dozen", " pcs", ""]
+    lines = []
+    for name in names:
+        if rng.random() < 0.1:
+            lines.append(name)
+        else:
+            lines.append(f"{name}, {rng.randint(1, 50)}{rng.choice(units)}")
+        if rng.random() < 0.05:
+            lines.append("")
+    return "\n".join(lines)
+
+def make_draft_items(rng, names, categories=None):
+    items = [{"name": name, "quantity": f"{rng.randint(1, 20)}kg"} for name in names]
+    if categories:
+        for item in items:
+            item["category"] = rng.choice(categories)
+    return items
+
+# ============================================
+# TIMING
+# ============================================
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def measure(func, items, min_runs=5, min_seconds=0.2):
+    """Time repeated calls of func(); each call processes `items` units."""
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < min_runs or time.perf_counter() - started < min_seconds:
+        call_started = time.perf_counter_ns()
+        func()
+        samples.append(time.perf_counter_ns() - call_started)
+        if len(samples) >= 10000:
+            break
+    samples.sort()
+    mean_ns = statistics.fmean(samples)
+    return {
+        "items": items,
+        "runs": len(samples),
+        "items_per_sec": items / (mean_ns / 1e9) if mean_ns else 0.0,
+        "p50_us": percentile(samples, 0.50) / 1000,
+        "p95_us": percentile(samples, 0.95) / 1000,
+        "p99_us": percentile(samples, 0.99) / 1000,
+    }
+
+# ============================================
+# CASES
+# ============================================
+
+def use_keyword_database(database):
+    """Point app at a keyword store seeded with database, on a private in-memory client.
+
+    The learned tier gets an untrained model, which abstains, so runs never
+    train from (or read) the module-level storage client.
+    """
+    app.keyword_store = app.KeywordStore(client=create_store("memory"), defaults=database)
+    app.category_model = CategoryModel()
+
+def use_vendors(categories):
+    """Point app at a vendor manager with one vendor per category, on a private in-memory client."""
+    app.vendor_manager = app.VendorManager(client=create_store("memory"))
+    for index, category in enumerate(categories):
+        app.vendor_manager.add_vendor(category, f"Vendor {index}", f"98765{index:05d}")
+
+def run_benchmarks(seed=0, sizes=DRAFT_SIZES, categories=DEFAULT_CATEGORIES,
+                   keywords_per_category=DEFAULT_KEYWORDS_PER_CATEGORY):
+    rng = random.Random(seed)
+    database = make_keyword_database(rng, categories, keywords_per_category)
+    original = app.keyword_store
+    original_model = app.category_model
+    original_vendors = app.vendor_manager
+    results = {}
+
+    try:
+        use_keyword_database(database)
+        use_vendors(list(database))
+        keyword_count = sum(len(keywords) for keywords in database.values())
+
+        results["keyword_index_build"] = measure(lambda: app.KeywordIndex(database), keyword_count)
+
+        # Per-item latency of a single uncached categorization
+        names = make_item_names(rng, database, 2000)
+        index = app.get_keyword_index()
+        iterator = iter(names * 100)
+        results["categorize_item_uncached"] = measure(
+            lambda: index.categorize(next(iterator).lower().strip()), 1, min_runs=2000
+        )
+
+        # Misses that fall through to the fuzzy tier, after its one-off build
+        index = app.KeywordIndex(database)
+        results["fuzzy_index_build"] = measure(lambda: app.KeywordIndex(database).fuzzy, keyword_count, min_runs=3)
+        index.fuzzy
+        typos = iter(make_misspellings(rng, database, 2000) * 100)
+        results["categorize_item_fuzzy"] = measure(lambda: index.categorize(next(typos)), 1, min_runs=2000)
+
+        for size in sizes:
+            names = make_item_names(rng, database, size)
+            paste = make_paste(rng, names)
+            draft_items = make_draft_items(rng, names)
+            message = app.generate_whatsapp_message("Vendor", draft_items)
+
+            def categorize_cold(names=names):
+                app.invalidate_keyword_index()
+                app.get_keyword_index()
+                return app.categorize_items(names)
+
+            results[f"categorize_items_cold[{size}]"] = measure(categorize_cold, size)
+            results[f"categorize_items_warm[{size}]"] = measure(lambda names=names: app.categorize_items(names), size)
+            results[f"parse_bulk_items[{size}]"] = measure(lambda paste=paste: app.parse_bulk_items(paste), size)
+            results[f"generate_whatsapp_message[{size}]"] = measure(
+                lambda items=draft_items: app.generate_whatsapp_message("Vendor", items), size
+            )
+            results[f"create_whatsapp_url[{size}]"] = measure(
+                lambda message=message: app.create_whatsapp_url("98765 43210", message), size
+            )
+            categorized = make_draft_items(rng, names, list(database))
+            results[f"prepare_send_bundle[{size}]"] = measure(
+                lambda items=categorized: app.prepare_send_bundle(items), size
+            )
+    finally:
+        app.keyword_store = original
+        app.category_model = original_model
+        app.vendor_manager = original_vendors
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "seed": seed,
+            "categories": categories,
+            "keywords_per_category": keywords_per_category,
+        },
+        "results": results,
+    }
+
+# ============================================
+# REPORTING
+# ============================================
+
+def print_results(report, baseline=None):
+    header = f"{'case':<38}{'items/s':>14}{'p50 us':>12}{'p95 us':>12}{'p99 us':>12}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, result in report["results"].items():
+        line = (
+            f"{name:<38}{result['items_per_sec']:>14,.0f}{result['p50_us']:>12.1f}"
+            f"{result['p95_us']:>12.1f}{result['p99_us']:>12.1f}"
+        )
+        base = (baseline or {}).get("results", {}).get(name)
+        if base and base["p50_us"]:
+            line += f"{result['p50_us'] / base['p50_us']:>9.2f}x"
+        print(line)
+
+def find_regressions(report, baseline, tolerance):
+    regressions = []
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if base["p50_us"] and result["p50_us"] > base["p50_us"] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {base['p50_us']:.1f}us -> {result['p50_us']:.1f}us")
+        elif base["items_per_sec"] and result["items_per_sec"] < base["items_per_sec"] / (1 + tolerance):
+            regressions.append(
+                f"{name}: throughput {base['items_per_sec']:,.0f}/s -> {result['items_per_sec']:,.0f}/s"
+            )
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark OrderFlow hot paths.")
+    parser.add_argument("--save", metavar="PATH", help="Write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before failing")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DRAFT_SIZES)
+    parser.add_argument("--categories", type=int, default=DEFAULT_CATEGORIES)
+    parser.add_argument("--keywords-per-category", type=int, default=DEFAULT_KEYWORDS_PER_CATEGORY)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.seed, args.sizes, args.categories, args.keywords_per_category)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_results(report, baseline)
+
+    if args.save:
+        with open(args.save, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+    if baseline:
+        regressions = find_regressions(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
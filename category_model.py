@@ -0,0 +1,205 @@
+"""Learned categorization for names the keyword rules cannot place.
+
+CategoryModel is a multinomial naive Bayes classifier over hashed
+character n-grams, so "paneer tikka masala" and "panner tika" share most
+of their features even when no keyword matches. It learns incrementally:
+partial_fit() adds counts, and the log-probability tables are rebuilt
+lazily on the next prediction. predict() scores a whole batch with a few
+NumPy operations, and each result carries a confidence between 0 and 1.
+
+ModelTrainer feeds the model from past orders (via order_export's row
+iterator) on a background thread, then picks up newly sent orders every
+refresh interval. It only learns categories that came from a keyword rule
+or a person: lines still carrying a category_confidence were the fuzzy
+tier's or the model's own guess, and learning them would feed its
+mistakes back in as labels.
+"""
+
+import threading
+import zlib
+
+import numpy as np
+
+from order_export import EXPORT_PAGE_SIZE, iter_order_rows
+
+NGRAM_SIZES = (2, 3, 4)
+FEATURE_BUCKETS = 1 << 15
+SMOOTHING = 0.1
+# Below this many training items the model abstains
+MIN_TRAINING_ITEMS = 20
+MODEL_REFRESH_SECONDS = 600
+TRAINING_CHUNK = 1000
+
+
+def ngram_features(name):
+    """Hashed character n-gram buckets of a name (padded so word edges count)."""
+    padded = f" {' '.join(name.lower().split())} "
+    features = []
+    for size in NGRAM_SIZES:
+        for start in range(len(padded) - size + 1):
+            features.append(zlib.crc32(padded[start:start + size].encode()) & (FEATURE_BUCKETS - 1))
+    return features
+
+
+def _encode(names):
+    """Flatten a batch into feature columns plus per-name offsets into them."""
+    columns = []
+    offsets = [0]
+    for name in names:
+        columns.extend(ngram_features(name))
+        offsets.append(len(columns))
+    return np.asarray(columns, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+
+
+class CategoryModel:
+    """Incremental naive Bayes over character n-grams."""
+
+    def __init__(self, buckets=FEATURE_BUCKETS, smoothing=SMOOTHING):
+        self.buckets = buckets
+        self.smoothing = smoothing
+        self.classes = []
+        self._class_ids = {}
+        self.class_counts = np.zeros(0, dtype=np.float64)
+        self.feature_counts = np.zeros((0, buckets), dtype=np.float32)
+        self.trained_items = 0
+        self._lock = threading.Lock()
+        self._params = None
+
+    def _class_id(self, label):
+        # Caller holds the lock
+        class_id = self._class_ids.get(label)
+        if class_id is None:
+            class_id = len(self.classes)
+            self._class_ids[label] = class_id
+            self.classes.append(label)
+            self.class_counts = np.append(self.class_counts, 0.0)
+            self.feature_counts = np.vstack([self.feature_counts, np.zeros((1, self.buckets), dtype=np.float32)])
+        return class_id
+
+    def partial_fit(self, names, labels):
+        """Add (name, label) examples. Returns how many were learned."""
+        pairs = [(name, label) for name, label in zip(names, labels) if name and label]
+        if not pairs:
+            return 0
+        columns, offsets = _encode([name for name, _ in pairs])
+        rows = np.repeat(np.arange(len(pairs)), np.diff(offsets))
+
+        with self._lock:
+            label_ids = np.asarray([self._class_id(label) for _, label in pairs], dtype=np.int64)
+            np.add.at(self.feature_counts, (label_ids[rows], columns), 1.0)
+            self.class_counts += np.bincount(label_ids, minlength=len(self.classes))
+            self.trained_items += len(pairs)
+            self._params = None
+        return len(pairs)
+
+    def _parameters(self):
+        """(classes, log_prior, log_likelihood[bucket, class]) for the current counts."""
+        with self._lock:
+            if self._params is None and self.trained_items >= MIN_TRAINING_ITEMS and len(self.classes) > 1:
+                smoothed = self.feature_counts.astype(np.float64) + self.smoothing
+                log_likelihood = np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))
+                log_prior = np.log(self.class_counts / self.class_counts.sum())
+                self._params = (list(self.classes), log_prior, np.ascontiguousarray(log_likelihood.T))
+            return self._params
+
+    def predict(self, names):
+        """Return (category, confidence) per name; (None, 0.0) while the model is untrained."""
+        params = self._parameters()
+        if params is None or not names:
+            return [(None, 0.0)] * len(names)
+        classes, log_prior, log_likelihood = params
+
+        columns, offsets = _encode(names)
+        # Sum each name's feature rows with one cumulative sum over the whole batch
+        cumulative = np.zeros((len(columns) + 1, len(classes)))
+        np.cumsum(log_likelihood[columns], axis=0, out=cumulative[1:])
+        lengths = np.maximum(np.diff(offsets), 1)[:, None]
+        # Averaging per n-gram keeps long names from producing overconfident scores
+        scores = (cumulative[offsets[1:]] - cumulative[offsets[:-1]]) / lengths + log_prior
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+        best = probabilities.argmax(axis=1)
+        confidence = probabilities[np.arange(len(names)), best]
+        return [(classes[index], float(score)) for index, score in zip(best, confidence)]
+
+
+class ModelTrainer:
+    """Background thread that trains a CategoryModel from sent orders.
+
+    The first pass reads the whole orders collection page by page; later
+    passes start at the newest sent_at already seen. Only the orders sent
+    at exactly that instant are remembered, to skip them on the next pass,
+    so the trainer's state stays small however many orders there are.
+    The cursor moves after every chunk is fitted, so a pass that fails part
+    way resumes after the last fitted chunk rather than learning it twice.
+    """
+
+    def __init__(self, model, orders_ref, interval=MODEL_REFRESH_SECONDS, page_size=EXPORT_PAGE_SIZE):
+        self.model = model
+        self.orders_ref = orders_ref
+        self.interval = interval
+        self.page_size = page_size
+        self.last_sent_at = None
+        self.error = None
+        # Orders sent at last_sent_at; the next pass starts there again
+        self._boundary_orders = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sync(self):
+        """Learn from orders not seen yet. Returns the number of items learned."""
+        names = []
+        labels = []
+        learned = 0
+        newest = self.last_sent_at
+        boundary = set(self._boundary_orders)
+        current = None
+        for row in iter_order_rows(self.orders_ref, page_size=self.page_size, start=self.last_sent_at):
+            sent_at = row["sent_at"]
+            if sent_at is None:
+                continue
+            if sent_at == self.last_sent_at and row["order_id"] in self._boundary_orders:
+                continue
+            # Only fit between orders, so the cursor never stops inside one
+            if row["order_id"] != current and len(names) >= TRAINING_CHUNK:
+                learned += self._learn(names, labels, newest, boundary)
+                names, labels = [], []
+            current = row["order_id"]
+            # Rows come oldest first, so sent_at only moves forward
+            if newest is None or sent_at > newest:
+                newest = sent_at
+                boundary = set()
+            boundary.add(row["order_id"])
+            if row["category"] and row["category"] != "Uncategorized" and row.get("category_confidence") is None:
+                names.append(row["name"])
+                labels.append(row["category"])
+        learned += self._learn(names, labels, newest, boundary)
+        return learned
+
+    def _learn(self, names, labels, newest, boundary):
+        """Fit a chunk, then move the cursor past the orders it came from."""
+        learned = self.model.partial_fit(names, labels)
+        self._boundary_orders = set(boundary)
+        self.last_sent_at = newest
+        return learned
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+                self.error = None
+            except Exception as error:
+                # Keep the last good model; try again next interval
+                self.error = error
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="category-model-trainer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,66 @@
+"""Regression checks for the keyword and fuzzy categorization tiers.
+
+Short everyday names that are one letter away from a keyword must stay
+Uncategorized rather than pick up a confident wrong category, while real
+typos and transliterations must still match, and fuzzy matches must come
+back with a confidence below 1.0 so review flags them. Runs against
+DEFAULT_KEYWORDS with the in-memory storage backend.
+
+Run: python check_categorize.py
+"""
+
+import os
+import sys
+
+os.environ.setdefault("ORDERFLOW_STORAGE", "memory")
+
+from app import DEFAULT_KEYWORDS, KeywordIndex  # noqa: E402
+
+# Name -> category the rules must give; None means Uncategorized
+EXPECTED = {
+    # One edit from cake, fish/meat, soap and curd
+    "coke": None,
+    "dish wash": None,
+    "soup": None,
+    "card": None,
+    # Keyword and substring hits
+    "milk": "Dairy & Milk Products",
+    "amul butter": "Dairy & Milk Products",
+    "tomatos": "Vegetables",
+    # Typos on longer words
+    "chiken": "Meat, Poultry & Seafood",
+    "panner": "Dairy & Milk Products",
+    "detergnet": "Cleaning & Kitchen Supplies",
+    # Transliterations
+    "tamatar": "Vegetables",
+    "pyaz": "Vegetables",
+}
+# Names only the fuzzy tier can place; they must not claim full confidence
+FUZZY_ONLY = {"chiken", "panner", "detergnet"}
+
+
+def check(index):
+    failures = []
+    for name, expected in EXPECTED.items():
+        category, confidence = index.categorize_scored(name)
+        wanted = expected or "Uncategorized"
+        if category != wanted:
+            failures.append(f"{name!r}: got {category!r}, expected {wanted!r}")
+        elif name in FUZZY_ONLY and confidence >= 1.0:
+            failures.append(f"{name!r}: fuzzy match reported confidence {confidence}")
+    return failures
+
+
+def main():
+    failures = check(KeywordIndex(DEFAULT_KEYWORDS))
+    for failure in failures:
+        print(failure)
+    if failures:
+        print("FAILED")
+        return 1
+    print(f"{len(EXPECTED)} names OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
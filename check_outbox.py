@@ -0,0 +1,104 @@
+"""Checks for OutboxWorker's retry and dead-letter rules.
+
+An outage must never use up a queued write's attempts: after many
+transient failures (also when wrapped in another error), a permanent one
+still gets the full OUTBOX_MAX_ATTEMPTS before the entry is dead-lettered,
+and a poison entry is set aside without holding up the ones behind it.
+Runs against a throwaway SQLite outbox; no storage backend is involved.
+
+Run: python check_outbox.py
+"""
+
+import os
+import sys
+import tempfile
+
+from outbox import OUTBOX_MAX_ATTEMPTS, Outbox, OutboxWorker
+
+OUTLET = "main"
+
+
+class Offline(Exception):
+    """Stands in for the app's transient storage errors."""
+
+
+class Wrapped(Exception):
+    """An error that carries the real one as .cause, like RetryError."""
+
+    def __init__(self, cause):
+        super().__init__(str(cause))
+        self.cause = cause
+
+
+def failing(errors, applied):
+    """apply() that raises the queued errors in turn, then records what it applied."""
+    def apply(entries):
+        if errors:
+            raise errors.pop(0)
+        applied.extend(payload["n"] for _, _, payload in entries if not payload.get("poison"))
+        if any(payload.get("poison") for _, _, payload in entries):
+            raise ValueError("poison")
+    return apply
+
+
+def drain(worker, times):
+    for _ in range(times):
+        try:
+            worker.drain()
+        except Exception:
+            pass
+
+
+def check_outage_then_permanent(path):
+    outbox = Outbox(path)
+    errors = [Offline("down")] * (OUTBOX_MAX_ATTEMPTS + 2) + [Wrapped(Offline("token refresh"))] * 3
+    errors += [ValueError("bad payload")]
+    applied = []
+    worker = OutboxWorker(outbox, OUTLET, failing(errors, applied), transient=(Offline,))
+    outbox.enqueue(OUTLET, "op", {"n": 1})
+
+    drain(worker, len(errors))
+    status = outbox.status(OUTLET)
+    failures = []
+    if status["dead"]:
+        failures.append(f"outage plus one permanent error dead-lettered the write: {status}")
+    drain(worker, 1)
+    if applied != [1] or outbox.status(OUTLET)["pending"]:
+        failures.append(f"write not applied after the outage: applied={applied} {outbox.status(OUTLET)}")
+    outbox.close()
+    return failures
+
+
+def check_poison_is_set_aside(path):
+    outbox = Outbox(path)
+    applied = []
+    worker = OutboxWorker(outbox, OUTLET, failing([], applied), transient=(Offline,))
+    outbox.enqueue(OUTLET, "op", {"n": 1})
+    outbox.enqueue(OUTLET, "op", {"n": 2, "poison": True})
+    outbox.enqueue(OUTLET, "op", {"n": 3})
+
+    drain(worker, OUTBOX_MAX_ATTEMPTS * 3)
+    status = outbox.status(OUTLET)
+    failures = []
+    if status["dead"] != 1 or status["pending"] or 3 not in applied:
+        failures.append(f"poison entry not isolated: applied={applied} {status}")
+    outbox.close()
+    return failures
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        failures += check_outage_then_permanent(os.path.join(workdir, "outage.db"))
+        failures += check_poison_is_set_aside(os.path.join(workdir, "poison.db"))
+    for failure in failures:
+        print(failure)
+    if failures:
+        print("FAILED")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,760 @@
+"""Storage backends with the subset of the Firestore client API OrderFlow uses.
+
+This API is the storage interface the managers in app.py depend on:
+collections and subcollections, documents, queries with cursors, write
+batches, update-time preconditions, field transforms (SERVER_TIMESTAMP,
+Increment, ArrayUnion, ArrayRemove, DELETE_FIELD) and snapshot listeners.
+google.cloud.firestore.Client provides it natively; DocumentStore
+implements it on top of three primitives (read a document, list a
+collection, apply a set of changes) with two concrete stores:
+
+MemoryClient  - a dict; fast, for tests, benchmarks and load runs
+SqliteClient  - one SQLite file; persistent, for offline use
+
+All writes are committed under one lock, so a store behaves like a single
+Firestore instance when many threads hit it at once. Snapshot listeners
+only see writes made through the same client object.
+"""
+
+import copy
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import (
+    DELETE_FIELD,
+    SERVER_TIMESTAMP,
+    ArrayRemove,
+    ArrayUnion,
+    Increment,
+)
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+# ============================================
+# HELPERS
+# ============================================
+
+def _split_field_path(field_path):
+    return field_path.split('.')
+
+def _get_field(data, field_path):
+    value = data
+    for part in _split_field_path(field_path):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+def _type_rank(value):
+    # Firestore orders values of different types by type first
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, list):
+        return 7
+    if isinstance(value, dict):
+        return 8
+    return 6
+
+def _sort_key(value):
+    if isinstance(value, (list, dict)):
+        return (_type_rank(value), repr(value))
+    return (_type_rank(value), value)
+
+def _matches(value, op, expected):
+    if op == '==':
+        return value == expected
+    if op == '!=':
+        return value != expected
+    if op == 'in':
+        return value in expected
+    if op == 'not-in':
+        return value not in expected
+    if op == 'array_contains':
+        return isinstance(value, list) and expected in value
+    if op == 'array_contains_any':
+        return isinstance(value, list) and any(v in value for v in expected)
+    if _type_rank(value) != _type_rank(expected):
+        return False
+    if op == '<':
+        return value < expected
+    if op == '<=':
+        return value <= expected
+    if op == '>':
+        return value > expected
+    if op == '>=':
+        return value >= expected
+    raise ValueError(f"Unsupported operator: {op}")
+
+def _apply_transform(current, value, now):
+    """Resolve a sentinel or transform against the field's current value."""
+    if value is SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for element in value.values:
+            if element not in result:
+                result.append(copy.deepcopy(element))
+        return result
+    if isinstance(value, ArrayRemove):
+        result = list(current) if isinstance(current, list) else []
+        return [element for element in result if element not in value.values]
+    if isinstance(value, dict):
+        return _resolve_nested(value, now)
+    return copy.deepcopy(value)
+
+def _merge_dict(target, source, now):
+    """Apply set(merge=True) semantics: nested maps are merged key by key."""
+    for key, value in source.items():
+        if value is DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            nested = target.get(key) if isinstance(target.get(key), dict) else {}
+            target[key] = _merge_dict(nested, value, now)
+        else:
+            target[key] = _apply_transform(target.get(key), value, now)
+    return target
+
+def _resolve_nested(data, now):
+    result = {}
+    for key, value in data.items():
+        if value is DELETE_FIELD:
+            continue
+        if isinstance(value, dict):
+            result[key] = _resolve_nested(value, now)
+        else:
+            result[key] = _apply_transform(None, value, now)
+    return result
+
+def _update_paths(target, field_updates, now):
+    """Apply update() semantics: keys are dotted field paths."""
+    for field_path, value in field_updates.items():
+        parts = _split_field_path(field_path)
+        node = target
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        leaf = parts[-1]
+        if value is DELETE_FIELD:
+            node.pop(leaf, None)
+        elif isinstance(value, dict):
+            node[leaf] = _resolve_nested(value, now)
+        else:
+            node[leaf] = _apply_transform(node.get(leaf), value, now)
+    return target
+
+def _project(data, field_paths):
+    result = {}
+    for field_path in field_paths:
+        try:
+            value = _get_field(data, field_path)
+        except KeyError:
+            continue
+        parts = _split_field_path(field_path)
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return result
+
+# ============================================
+# SNAPSHOTS & REFERENCES
+# ============================================
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        if self._data is None:
+            raise KeyError(field_path)
+        return copy.deepcopy(_get_field(self._data, field_path))
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def collection(self, collection_id):
+        return CollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._snapshot(self, field_paths)
+
+    def create(self, document_data):
+        return self._client._commit([('create', self, document_data, None)])[0]
+
+    def set(self, document_data, merge=False):
+        return self._client._commit([('set', self, document_data, merge)])[0]
+
+    def update(self, field_updates, option=None):
+        return self._client._commit([('update', self, field_updates, option)])[0]
+
+    def delete(self, option=None):
+        return self._client._commit([('delete', self, None, option)])[0].update_time
+
+    def on_snapshot(self, callback):
+        return self._client._listen(self, callback)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other._client is self._client and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+
+class Query:
+    ASCENDING = ASCENDING
+    DESCENDING = DESCENDING
+
+    def __init__(self, client, path, filters=(), orders=(), limit=None, offset=0,
+                 start=None, projection=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+        self._start = start
+        self._projection = projection
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters,
+            'orders': self._orders,
+            'limit': self._limit,
+            'offset': self._offset,
+            'start': self._start,
+            'projection': self._projection,
+        }
+        state.update(changes)
+        return Query(self._client, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def select(self, field_paths):
+        return self._copy(projection=tuple(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, False))
+
+    def start_at(self, document_fields_or_snapshot):
+        return self._copy(start=(document_fields_or_snapshot, True))
+
+    def _cursor_values(self, cursor):
+        if isinstance(cursor, DocumentSnapshot):
+            data = cursor._data or {}
+            values = []
+            for field_path, _ in self._orders:
+                values.append(_get_field(data, field_path))
+            return values, cursor.id
+        return [_get_field(cursor, field_path) for field_path, _ in self._orders], None
+
+    def _execute(self):
+        records = self._client._list(self._path)
+        rows = []
+        for doc_id, (data, create_time, update_time) in records:
+            try:
+                if not all(_matches(_get_field(data, f), op, v) for f, op, v in self._filters):
+                    continue
+                sort_values = [_get_field(data, f) for f, _ in self._orders]
+            except KeyError:
+                # Missing fields never match a filter and are excluded by order_by
+                continue
+            rows.append((sort_values, doc_id, data, create_time, update_time))
+
+        def compare(row_values, row_id, cursor_values, cursor_id):
+            for (field_path, direction), value, cursor_value in zip(self._orders, row_values, cursor_values):
+                a, b = _sort_key(value), _sort_key(cursor_value)
+                if a != b:
+                    result = -1 if a < b else 1
+                    return -result if direction == DESCENDING else result
+            if cursor_id is None or row_id == cursor_id:
+                return 0
+            return -1 if row_id < cursor_id else 1
+
+        # Stable multi-key sort, last key first; document id breaks ties
+        rows.sort(key=lambda row: row[1])
+        for index in reversed(range(len(self._orders))):
+            direction = self._orders[index][1]
+            rows.sort(key=lambda row: _sort_key(row[0][index]), reverse=(direction == DESCENDING))
+
+        if self._start is not None:
+            cursor, inclusive = self._start
+            cursor_values, cursor_id = self._cursor_values(cursor)
+            kept = []
+            for row in rows:
+                position = compare(row[0], row[1], cursor_values, cursor_id)
+                if position > 0 or (inclusive and position == 0):
+                    kept.append(row)
+            rows = kept
+
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+
+        snapshots = []
+        for _, doc_id, data, create_time, update_time in rows:
+            reference = DocumentReference(self._client, f"{self._path}/{doc_id}")
+            if self._projection is not None:
+                data = _project(data, self._projection)
+            snapshots.append(DocumentSnapshot(reference, copy.deepcopy(data), create_time, update_time))
+        return snapshots
+
+    def stream(self, transaction=None):
+        snapshots = self._execute()
+        self._client._count_reads(max(len(snapshots), 1))
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self._client._listen(self, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        if '/' not in self._path:
+            return None
+        return DocumentReference(self._client, self._path.rsplit('/', 1)[0])
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = uuid.uuid4().hex[:20]
+        return DocumentReference(self._client, f"{self._path}/{document_id}")
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        result = reference.create(document_data)
+        return result.update_time, reference
+
+    def list_documents(self, page_size=None):
+        return [DocumentReference(self._client, f"{self._path}/{doc_id}") for doc_id, _ in self._client._list(self._path)]
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, None))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference, field_updates, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, option))
+
+    def __len__(self):
+        return len(self._writes)
+
+    def commit(self):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class Watch:
+    def __init__(self, client, listener):
+        self._client = client
+        self._listener = listener
+
+    def unsubscribe(self):
+        self._client._unlisten(self._listener)
+
+# ============================================
+# DOCUMENT STORE
+# ============================================
+
+class DocumentStore:
+    """Firestore-shaped client over abstract storage primitives.
+
+    Subclasses implement _get_record, _list_records and _store. A record is
+    a (data, create_time, update_time) tuple keyed by document path.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._last_time = datetime.now(timezone.utc)
+        self.reads = 0
+        self.writes = 0
+
+    # --- Public client API ---
+
+    def collection(self, *path):
+        return CollectionReference(self, '/'.join(path))
+
+    def document(self, *path):
+        return DocumentReference(self, '/'.join(path))
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def write_option(self, last_update_time=None, exists=None):
+        return SimpleNamespace(last_update_time=last_update_time, exists=exists)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        for reference in references:
+            yield self._snapshot(reference, field_paths)
+
+    def close(self):
+        with self._lock:
+            self._listeners = []
+
+    # --- Storage primitives ---
+
+    def _get_record(self, path):
+        """Return the record stored at path, or None."""
+        raise NotImplementedError
+
+    def _list_records(self, collection_path):
+        """Return (document_id, record) pairs directly under collection_path."""
+        raise NotImplementedError
+
+    def _store(self, changes):
+        """Atomically apply {path: record or None}; None deletes."""
+        raise NotImplementedError
+
+    def _list(self, collection_path):
+        with self._lock:
+            return self._list_records(collection_path)
+
+    # --- Reads ---
+
+    def _count_reads(self, count):
+        with self._lock:
+            self.reads += count
+
+    def _snapshot(self, reference, field_paths=None):
+        with self._lock:
+            self.reads += 1
+            record = self._get_record(reference.path)
+            if record is None:
+                return DocumentSnapshot(reference, None, read_time=self._last_time)
+            data, create_time, update_time = record
+            if field_paths is not None:
+                data = _project(data, field_paths)
+            return DocumentSnapshot(reference, copy.deepcopy(data), create_time, update_time, self._last_time)
+
+    # --- Writes ---
+
+    def _next_time(self):
+        now = datetime.now(timezone.utc)
+        if now <= self._last_time:
+            now = self._last_time + timedelta(microseconds=1)
+        self._last_time = now
+        return now
+
+    def _commit(self, writes):
+        with self._lock:
+            now = self._next_time()
+            pending = {}
+            results = []
+
+            def current(path):
+                if path in pending:
+                    return pending[path]
+                return self._get_record(path)
+
+            for kind, reference, data, option in writes:
+                path = reference.path
+                record = current(path)
+
+                if kind in ('update', 'delete') and option is not None:
+                    expected = getattr(option, 'last_update_time', None)
+                    must_exist = getattr(option, 'exists', None)
+                    if expected is not None and (record is None or record[2] != expected):
+                        raise FailedPrecondition(f"Document {path} was modified since {expected}")
+                    if must_exist is True and record is None:
+                        raise NotFound(f"No document to update: {path}")
+                    if must_exist is False and record is not None:
+                        raise AlreadyExists(f"Document already exists: {path}")
+
+                if kind == 'create':
+                    if record is not None:
+                        raise AlreadyExists(f"Document already exists: {path}")
+                    pending[path] = (_resolve_nested(data, now), now, now)
+                elif kind == 'set':
+                    # For set() the option slot carries the merge flag
+                    if option and record is not None:
+                        merged = _merge_dict(copy.deepcopy(record[0]), data, now)
+                        pending[path] = (merged, record[1], now)
+                    else:
+                        create_time = record[1] if record is not None else now
+                        pending[path] = (_resolve_nested(data, now), create_time, now)
+                elif kind == 'update':
+                    if record is None:
+                        raise NotFound(f"No document to update: {path}")
+                    updated = _update_paths(copy.deepcopy(record[0]), data, now)
+                    pending[path] = (updated, record[1], now)
+                elif kind == 'delete':
+                    pending[path] = None
+                results.append(SimpleNamespace(update_time=now))
+
+            self._store(pending)
+            self.writes += len(writes)
+            listeners = list(self._listeners)
+
+        self._notify(listeners, set(pending))
+        return results
+
+    # --- Listeners ---
+
+    def _listen(self, target, callback):
+        listener = SimpleNamespace(target=target, callback=callback, seen={})
+        with self._lock:
+            self._listeners.append(listener)
+        self._deliver(listener, initial=True)
+        return Watch(self, listener)
+
+    def _unlisten(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _notify(self, listeners, paths):
+        for listener in listeners:
+            target = listener.target
+            if isinstance(target, DocumentReference):
+                touched = target.path in paths
+            else:
+                prefix = target._path + '/'
+                touched = any(path.startswith(prefix) and '/' not in path[len(prefix):] for path in paths)
+            if touched:
+                self._deliver(listener)
+
+    def _deliver(self, listener, initial=False):
+        target = listener.target
+        with self._lock:
+            read_time = self._last_time
+            if isinstance(target, DocumentReference):
+                record = self._get_record(target.path)
+                if record is None:
+                    snapshots = [DocumentSnapshot(target, None, read_time=read_time)]
+                else:
+                    snapshots = [DocumentSnapshot(target, copy.deepcopy(record[0]), record[1], record[2], read_time)]
+            else:
+                snapshots = target._execute()
+
+        seen = {snapshot.reference.path: snapshot.update_time for snapshot in snapshots if snapshot.exists}
+        changes = []
+        for snapshot in snapshots:
+            if not snapshot.exists:
+                continue
+            previous = listener.seen.get(snapshot.reference.path)
+            if previous is None:
+                changes.append(SimpleNamespace(type=SimpleNamespace(name='ADDED'), document=snapshot))
+            elif previous != snapshot.update_time:
+                changes.append(SimpleNamespace(type=SimpleNamespace(name='MODIFIED'), document=snapshot))
+        for path in listener.seen:
+            if path not in seen:
+                removed = DocumentSnapshot(DocumentReference(self, path), None, read_time=read_time)
+                changes.append(SimpleNamespace(type=SimpleNamespace(name='REMOVED'), document=removed))
+        listener.seen = seen
+
+        if changes or initial or isinstance(target, DocumentReference):
+            listener.callback(snapshots, changes, read_time)
+
+
+class MemoryClient(DocumentStore):
+    """Document store held in a dict; nothing survives the process."""
+
+    def __init__(self):
+        super().__init__()
+        self._records = {}
+
+    def _get_record(self, path):
+        return self._records.get(path)
+
+    def _list_records(self, collection_path):
+        prefix = collection_path + '/'
+        return [
+            (path[len(prefix):], record)
+            for path, record in self._records.items()
+            if path.startswith(prefix) and '/' not in path[len(prefix):]
+        ]
+
+    def _store(self, changes):
+        for path, record in changes.items():
+            if record is None:
+                self._records.pop(path, None)
+            else:
+                self._records[path] = record
+
+# ============================================
+# SQLITE CLIENT
+# ============================================
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__} in SqliteClient")
+
+def _decode_object(obj):
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class SqliteClient(DocumentStore):
+    """Document store persisted in a single SQLite file.
+
+    Documents are JSON rows keyed by path, with their parent collection
+    indexed for queries. Filtering and ordering happen in Python, as in
+    MemoryClient, so query cost grows with collection size.
+    """
+
+    def __init__(self, path="orderflow.db"):
+        super().__init__()
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " path TEXT PRIMARY KEY,"
+            " parent TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " create_time TEXT NOT NULL,"
+            " update_time TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_parent ON documents (parent)")
+
+        # Keep update times increasing across restarts
+        row = self._conn.execute("SELECT MAX(update_time) FROM documents").fetchone()
+        if row[0]:
+            self._last_time = max(self._last_time, datetime.fromisoformat(row[0]))
+
+    def _record(self, row):
+        data, create_time, update_time = row
+        return (
+            json.loads(data, object_hook=_decode_object),
+            datetime.fromisoformat(create_time),
+            datetime.fromisoformat(update_time),
+        )
+
+    def _get_record(self, path):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, create_time, update_time FROM documents WHERE path = ?", (path,)
+            ).fetchone()
+        return self._record(row) if row else None
+
+    def _list_records(self, collection_path):
+        rows = self._conn.execute(
+            "SELECT path, data, create_time, update_time FROM documents WHERE parent = ?",
+            (collection_path,),
+        ).fetchall()
+        return [(path.rsplit('/', 1)[-1], self._record(row)) for path, *row in rows]
+
+    def _store(self, changes):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for path, record in changes.items():
+                if record is None:
+                    self._conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+                    continue
+                data, create_time, update_time = record
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (path, parent, data, create_time, update_time)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (
+                        path,
+                        path.rsplit('/', 1)[0],
+                        json.dumps(data, default=_encode_value),
+                        create_time.isoformat(timespec='microseconds'),
+                        update_time.isoformat(timespec='microseconds'),
+                    ),
+                )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._conn.close()
+
+# ============================================
+# BACKEND SELECTION
+# ============================================
+
+BACKENDS = ("firestore", "memory", "sqlite")
+
+def create_store(backend, sqlite_path="orderflow.db"):
+    """Build a non-Firestore backend by name."""
+    if backend == "memory":
+        return MemoryClient()
+    if backend == "sqlite":
+        return SqliteClient(sqlite_path)
+    raise ValueError(f"Unknown storage backend: {backend} (expected one of {', '.join(BACKENDS)})")
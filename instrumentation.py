@@ -0,0 +1,275 @@
+"""Read/write accounting and latency timing for storage calls.
+
+InstrumentedClient wraps any storage client (Firestore, MemoryClient,
+SqliteClient) and records every call made through it, along with the
+documents it read or wrote and how long it took. Calls are attributed to
+the RerunStats active on the calling thread; Streamlit runs each session's
+script on its own thread, so each rerun gets its own numbers. Work on
+other threads (snapshot listeners, background jobs) lands in
+background_stats.
+
+Within a rerun, `with stats.screen("review"):` attributes calls to a
+screen. log_rerun() emits a rerun's numbers as one JSON log line, and
+enable_logging() prints those lines to stderr.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger("orderflow.data")
+
+_local = threading.local()
+
+# ============================================
+# STATS
+# ============================================
+
+def _empty_counters():
+    return {"reads": 0, "writes": 0, "calls": 0, "data_ms": 0.0, "wall_ms": 0.0}
+
+
+class RerunStats:
+    """Counters for one script run, split by screen."""
+
+    def __init__(self, label="", started=None):
+        self.rerun_id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.started = started if started is not None else time.perf_counter()
+        self.finished = None
+        self.marks = {}
+        self.current_screen = "app"
+        self.screens = {}
+        self.totals = _empty_counters()
+        self._lock = threading.Lock()
+
+    def record(self, operation, path, reads=0, writes=0, elapsed_ms=0.0):
+        with self._lock:
+            screen = self.screens.setdefault(self.current_screen, _empty_counters())
+            for counters in (screen, self.totals):
+                counters["reads"] += reads
+                counters["writes"] += writes
+                counters["calls"] += 1
+                counters["data_ms"] += elapsed_ms
+        logger.debug("%s %s reads=%d writes=%d %.1fms", operation, path, reads, writes, elapsed_ms)
+
+    @contextmanager
+    def screen(self, name):
+        previous = self.current_screen
+        self.current_screen = name
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.screens.setdefault(name, _empty_counters())["wall_ms"] += elapsed_ms
+            self.current_screen = previous
+
+    def mark(self, name):
+        """Record milliseconds since the run started, e.g. "first_paint"."""
+        self.marks[name] = (time.perf_counter() - self.started) * 1000
+        return self.marks[name]
+
+    def finish(self):
+        self.finished = time.perf_counter()
+        self.totals["wall_ms"] = (self.finished - self.started) * 1000
+        return self
+
+    def as_dict(self):
+        return {
+            "rerun_id": self.rerun_id,
+            "label": self.label,
+            "totals": dict(self.totals),
+            "marks": dict(self.marks),
+            "screens": {name: dict(counters) for name, counters in self.screens.items()},
+        }
+
+
+background_stats = RerunStats("background")
+
+
+def start_rerun(label="", started=None):
+    """Begin collecting for the script run on this thread and return its stats.
+
+    Pass started (a time.perf_counter() value) to time marks from earlier,
+    such as the top of the script before its imports.
+    """
+    _local.stats = RerunStats(label, started)
+    return _local.stats
+
+
+def current_stats():
+    return getattr(_local, "stats", None) or background_stats
+
+
+def log_rerun(stats, level=logging.INFO):
+    logger.log(level, json.dumps({"event": "rerun_data_access", **stats.as_dict()}))
+
+
+def enable_logging(level=logging.INFO):
+    """Send the rerun log lines to stderr (once per process)."""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
+# ============================================
+# CLIENT WRAPPERS
+# ============================================
+
+def _unwrap(value):
+    return getattr(value, "_target", value)
+
+
+def _timed(operation, path, func, reads=0, writes=0, count_result=None):
+    started = time.perf_counter()
+    result = func()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if count_result is not None:
+        reads = count_result(result)
+    current_stats().record(operation, path, reads=reads, writes=writes, elapsed_ms=elapsed_ms)
+    return result
+
+
+def _counting_listener(path, callback):
+    def listener(docs, changes, read_time):
+        # Listener deliveries are billed per changed document
+        background_stats.record("on_snapshot", path, reads=max(len(changes), 1))
+        return callback(docs, changes, read_time)
+    return listener
+
+
+class _Wrapper:
+    def __init__(self, target, path):
+        self._target = target
+        self._path = path
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class InstrumentedQuery(_Wrapper):
+    def _wrap(self, query):
+        return InstrumentedQuery(query, self._path)
+
+    def where(self, *args, **kwargs):
+        return self._wrap(self._target.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return self._wrap(self._target.order_by(*args, **kwargs))
+
+    def limit(self, count):
+        return self._wrap(self._target.limit(count))
+
+    def offset(self, num_to_skip):
+        return self._wrap(self._target.offset(num_to_skip))
+
+    def select(self, field_paths):
+        return self._wrap(self._target.select(field_paths))
+
+    def start_after(self, cursor):
+        return self._wrap(self._target.start_after(cursor))
+
+    def start_at(self, cursor):
+        return self._wrap(self._target.start_at(cursor))
+
+    def stream(self, *args, **kwargs):
+        # Drained here so the timing covers the whole round trip
+        docs = _timed("query", self._path, lambda: list(self._target.stream(*args, **kwargs)),
+                      count_result=lambda docs: max(len(docs), 1))
+        return iter(docs)
+
+    def get(self, *args, **kwargs):
+        return list(self.stream(*args, **kwargs))
+
+    def on_snapshot(self, callback):
+        return self._target.on_snapshot(_counting_listener(self._path, callback))
+
+
+class InstrumentedCollection(InstrumentedQuery):
+    def document(self, document_id=None):
+        reference = self._target.document(document_id) if document_id is not None else self._target.document()
+        return InstrumentedDocument(reference, f"{self._path}/{reference.id}")
+
+    def add(self, document_data, *args, **kwargs):
+        return _timed("add", self._path, lambda: self._target.add(document_data, *args, **kwargs), writes=1)
+
+    def list_documents(self, *args, **kwargs):
+        return _timed("list_documents", self._path,
+                      lambda: list(self._target.list_documents(*args, **kwargs)),
+                      count_result=lambda refs: max(len(refs), 1))
+
+
+class InstrumentedDocument(_Wrapper):
+    def collection(self, collection_id):
+        return InstrumentedCollection(self._target.collection(collection_id), f"{self._path}/{collection_id}")
+
+    def get(self, *args, **kwargs):
+        return _timed("get", self._path, lambda: self._target.get(*args, **kwargs), reads=1)
+
+    def create(self, document_data):
+        return _timed("create", self._path, lambda: self._target.create(document_data), writes=1)
+
+    def set(self, document_data, merge=False):
+        return _timed("set", self._path, lambda: self._target.set(document_data, merge=merge), writes=1)
+
+    def update(self, field_updates, option=None):
+        return _timed("update", self._path, lambda: self._target.update(field_updates, option=option), writes=1)
+
+    def delete(self, option=None):
+        return _timed("delete", self._path, lambda: self._target.delete(option=option), writes=1)
+
+    def on_snapshot(self, callback):
+        return self._target.on_snapshot(_counting_listener(self._path, callback))
+
+
+class InstrumentedBatch(_Wrapper):
+    def __init__(self, target):
+        super().__init__(target, "batch")
+        self._count = 0
+
+    def create(self, reference, document_data):
+        self._count += 1
+        self._target.create(_unwrap(reference), document_data)
+
+    def set(self, reference, document_data, merge=False):
+        self._count += 1
+        self._target.set(_unwrap(reference), document_data, merge=merge)
+
+    def update(self, reference, field_updates, option=None):
+        self._count += 1
+        self._target.update(_unwrap(reference), field_updates, option=option)
+
+    def delete(self, reference, option=None):
+        self._count += 1
+        self._target.delete(_unwrap(reference), option=option)
+
+    def commit(self):
+        count, self._count = self._count, 0
+        return _timed("commit", "batch", self._target.commit, writes=count)
+
+
+class InstrumentedClient(_Wrapper):
+    """Drop-in wrapper that accounts for every call made through a client."""
+
+    def __init__(self, target):
+        super().__init__(target, "")
+
+    def collection(self, *path):
+        return InstrumentedCollection(self._target.collection(*path), "/".join(path))
+
+    def document(self, *path):
+        return InstrumentedDocument(self._target.document(*path), "/".join(path))
+
+    def batch(self):
+        return InstrumentedBatch(self._target.batch())
+
+    def get_all(self, references, *args, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        return iter(_timed("get_all", "get_all", lambda: list(self._target.get_all(references, *args, **kwargs)),
+                           reads=len(references)))
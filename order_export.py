@@ -0,0 +1,218 @@
+"""Streaming export of order history to CSV or Parquet.
+
+Orders are read from Firestore one cursor page at a time and each order's
+items are flattened into one row per item, so peak memory depends on the
+page size (and the Parquet row group size), not on how many orders exist.
+Parquet output needs pyarrow (pip install pyarrow).
+
+Used by the history screen's download button (which holds the finished
+file in memory, so it is capped; bigger exports go through the CLI), and
+runnable on its own:
+
+    python order_export.py --format csv --output orders.csv
+    python order_export.py --format parquet --output orders.parquet \
+        --credentials service-account.json --since 2024-01-01
+"""
+
+import argparse
+import csv
+import io
+import sys
+from datetime import datetime, timedelta, timezone
+
+EXPORT_COLUMNS = [
+    "order_id",
+    "sent_at",
+    "sent_by",
+    "approved_by",
+    "item_id",
+    "name",
+    "quantity",
+    "quantity_value",
+    "quantity_unit",
+    "category",
+    "category_confidence",
+    "added_by",
+    "added_at",
+]
+
+EXPORT_PAGE_SIZE = 200
+PARQUET_ROW_GROUP_SIZE = 10000
+
+# The default outlet keeps the original top-level paths; the others live
+# under outlets/{id}/. Shared with app.py.
+DEFAULT_OUTLET = "main"
+
+
+def outlet_root(client, outlet=DEFAULT_OUTLET):
+    """Where an outlet's collections hang: the client itself, or its outlets/{id} document."""
+    if outlet == DEFAULT_OUTLET:
+        return client
+    return client.document("outlets", outlet)
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def iter_order_rows(orders_ref, page_size=EXPORT_PAGE_SIZE, start=None, end=None):
+    """Yield one flat dict per ordered item, oldest order first."""
+    cursor = None
+    while True:
+        query = orders_ref
+        if start is not None:
+            query = query.where("sent_at", ">=", start)
+        if end is not None:
+            query = query.where("sent_at", "<", end)
+        query = query.order_by("sent_at").limit(page_size)
+        if cursor is not None:
+            query = query.start_after(cursor)
+
+        docs = list(query.stream())
+        for doc in docs:
+            order = doc.to_dict()
+            for item in order.get("items") or []:
+                yield {
+                    "order_id": doc.id,
+                    "sent_at": order.get("sent_at"),
+                    "sent_by": order.get("sent_by", ""),
+                    "approved_by": order.get("approved_by", ""),
+                    "item_id": item.get("id", ""),
+                    "name": item.get("name", ""),
+                    "quantity": item.get("quantity", ""),
+                    "quantity_value": item.get("quantity_value"),
+                    "quantity_unit": item.get("quantity_unit") or "",
+                    "category": item.get("category", ""),
+                    # Set while the category is a fuzzy match or model guess nobody has confirmed
+                    "category_confidence": item.get("category_confidence"),
+                    "added_by": item.get("added_by", ""),
+                    "added_at": item.get("added_at", ""),
+                }
+
+        if len(docs) < page_size:
+            return
+        cursor = docs[-1]
+
+
+def write_csv(rows, fileobj):
+    """Write rows to a binary file object as UTF-8 CSV. Returns the row count."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+    writer = csv.DictWriter(text, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        if isinstance(row["sent_at"], datetime):
+            row = dict(row, sent_at=row["sent_at"].isoformat())
+        writer.writerow(row)
+        count += 1
+    text.flush()
+    text.detach()
+    return count
+
+
+def write_parquet(rows, fileobj, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """Write rows to a binary file object as Parquet. Returns the row count."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+
+    types = {
+        "sent_at": pa.timestamp("us", tz="UTC"),
+        "quantity_value": pa.float64(),
+        "category_confidence": pa.float64(),
+    }
+    schema = pa.schema([(column, types.get(column, pa.string())) for column in EXPORT_COLUMNS])
+
+    def flush(buffer, writer):
+        columns = {column: [row[column] for row in buffer] for column in schema.names}
+        columns["sent_at"] = [value if isinstance(value, datetime) else None for value in columns["sent_at"]]
+        for column in schema.names:
+            if column not in types:
+                columns[column] = [None if value is None else str(value) for value in columns[column]]
+        writer.write_table(pa.table(columns, schema=schema))
+
+    count = 0
+    buffer = []
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        for row in rows:
+            buffer.append(row)
+            count += 1
+            if len(buffer) >= row_group_size:
+                flush(buffer, writer)
+                buffer = []
+        if buffer or count == 0:
+            flush(buffer, writer)
+    return count
+
+
+def export_orders(orders_ref, fileobj, fmt="csv", page_size=EXPORT_PAGE_SIZE, start=None, end=None):
+    """Stream the orders collection into fileobj. Returns the row count."""
+    rows = iter_order_rows(orders_ref, page_size=page_size, start=start, end=end)
+    if fmt == "parquet":
+        return write_parquet(rows, fileobj)
+    if fmt == "csv":
+        return write_csv(rows, fileobj)
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+def _load_client(credentials_path):
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        if credentials_path.endswith(".toml"):
+            try:
+                import tomllib
+                with open(credentials_path, "rb") as secrets_file:
+                    secrets = tomllib.load(secrets_file)
+            except ImportError:
+                import toml
+                secrets = toml.load(credentials_path)
+            cred = credentials.Certificate(dict(secrets["firebase"]))
+        else:
+            cred = credentials.Certificate(credentials_path)
+        firebase_admin.initialize_app(cred)
+    return firestore.client()
+
+
+def _parse_day(value):
+    return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export OrderFlow order history.")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--output", help="Output file (CSV defaults to stdout)")
+    parser.add_argument(
+        "--credentials",
+        default=".streamlit/secrets.toml",
+        help="Service account JSON, or a secrets.toml with a [firebase] table",
+    )
+    parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+    parser.add_argument("--since", type=_parse_day, help="First day to include (YYYY-MM-DD)")
+    parser.add_argument("--until", type=_parse_day, help="Last day to include (YYYY-MM-DD)")
+    parser.add_argument("--outlet", default=DEFAULT_OUTLET, help=f"Export one outlet's orders (default: {DEFAULT_OUTLET})")
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet" and not args.output:
+        parser.error("--output is required for parquet")
+
+    end = args.until + timedelta(days=1) if args.until else None
+    client = _load_client(args.credentials)
+    orders_ref = outlet_root(client, args.outlet).collection("orders")
+
+    if args.output:
+        with open(args.output, "wb") as output:
+            count = export_orders(orders_ref, output, args.format, args.page_size, args.since, end)
+    else:
+        count = export_orders(orders_ref, sys.stdout.buffer, args.format, args.page_size, args.since, end)
+
+    print(f"Exported {count} rows", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
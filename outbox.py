@@ -0,0 +1,252 @@
+"""Local write-ahead queue for draft writes, drained to storage in the background.
+
+Outbox keeps queued writes in one SQLite file, so they survive a dropped
+connection or a restart. Each entry has an operation name, a JSON payload,
+the outlet it belongs to and an idempotency key generated when it is
+queued. OutboxWorker applies the unsynced entries of one outlet oldest
+first, a batch at a time, through a callback that must skip keys it has
+already applied (DraftManager.apply_queued records them in storage with
+the write itself). A failed batch stays at the head of the queue and is
+retried with exponential backoff, so later entries never overtake it.
+
+After a failure that is not one of the worker's transient errors (being
+offline, a contended draft), entries are retried one at a time so the
+bad one is isolated. Once it has failed OUTBOX_MAX_ATTEMPTS times it is
+dead-lettered: kept in the file with its error, but no longer pending,
+so the rest of the queue can drain.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+OUTBOX_BATCH_SIZE = 25
+OUTBOX_RETRY_SECONDS = 1.0
+OUTBOX_MAX_BACKOFF = 60.0
+OUTBOX_MAX_ATTEMPTS = 8
+# Synced entries are kept this long so the UI can report them
+OUTBOX_KEEP_SYNCED_SECONDS = 24 * 60 * 60
+
+
+class Outbox:
+    """SQLite-backed FIFO of writes waiting for storage."""
+
+    def __init__(self, path="orderflow_outbox.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " key TEXT UNIQUE NOT NULL,"
+            " outlet TEXT NOT NULL,"
+            " operation TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " queued_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " last_error TEXT,"
+            " synced_at REAL,"
+            " dead_at REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "dead_at" not in columns:
+            # Files created before dead-lettering
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN dead_at REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_unsynced ON outbox (outlet, synced_at, seq)")
+
+    def enqueue(self, outlet, operation, payload):
+        """Append a write and return its idempotency key."""
+        key = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO outbox (key, outlet, operation, payload, queued_at) VALUES (?, ?, ?, ?, ?)",
+                (key, outlet, operation, json.dumps(payload), time.time()),
+            )
+        return key
+
+    def pending(self, outlet, limit=None):
+        """Unsynced (key, operation, payload) entries for an outlet, oldest first."""
+        query = (
+            "SELECT key, operation, payload FROM outbox"
+            " WHERE outlet = ? AND synced_at IS NULL AND dead_at IS NULL ORDER BY seq"
+        )
+        params = (outlet,)
+        if limit is not None:
+            query += " LIMIT ?"
+            params += (limit,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [(key, operation, json.loads(payload)) for key, operation, payload in rows]
+
+    def mark_synced(self, keys):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "UPDATE outbox SET synced_at = ?, last_error = NULL WHERE key = ?", [(now, key) for key in keys]
+            )
+            self._conn.execute("DELETE FROM outbox WHERE synced_at < ?", (now - OUTBOX_KEEP_SYNCED_SECONDS,))
+            self._conn.execute("COMMIT")
+
+    def mark_failed(self, keys, error, count=True):
+        """Record error for keys, counting an attempt unless count is False.
+
+        Returns the head entry's attempt count.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = attempts + ?, last_error = ? WHERE key = ?",
+                [(1 if count else 0, str(error)[:500], key) for key in keys],
+            )
+            row = self._conn.execute("SELECT attempts FROM outbox WHERE key = ?", (keys[0],)).fetchone()
+        return row[0] if row else 0
+
+    def mark_dead(self, keys):
+        """Take entries out of the queue for good; they stay in the file for inspection."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("UPDATE outbox SET dead_at = ? WHERE key = ?", [(now, key) for key in keys])
+
+    def dead(self, outlet):
+        """Dead-lettered (key, operation, payload, last_error) entries for an outlet, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, operation, payload, last_error FROM outbox"
+                " WHERE outlet = ? AND dead_at IS NOT NULL ORDER BY seq",
+                (outlet,),
+            ).fetchall()
+        return [(key, operation, json.loads(payload), error) for key, operation, payload, error in rows]
+
+    def status(self, outlet):
+        """{pending, synced, dead, oldest_pending_at, last_synced_at, last_error} for an outlet."""
+        with self._lock:
+            pending, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(queued_at) FROM outbox"
+                " WHERE outlet = ? AND synced_at IS NULL AND dead_at IS NULL",
+                (outlet,),
+            ).fetchone()
+            # The head entry's error is the one holding the queue up
+            head = self._conn.execute(
+                "SELECT last_error FROM outbox WHERE outlet = ? AND synced_at IS NULL AND dead_at IS NULL"
+                " ORDER BY seq LIMIT 1",
+                (outlet,),
+            ).fetchone()
+            dead = self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE outlet = ? AND dead_at IS NOT NULL", (outlet,)
+            ).fetchone()[0]
+            synced, last_synced = self._conn.execute(
+                "SELECT COUNT(*), MAX(synced_at) FROM outbox WHERE outlet = ? AND synced_at IS NOT NULL",
+                (outlet,),
+            ).fetchone()
+        return {
+            "pending": pending,
+            "synced": synced,
+            "dead": dead,
+            "oldest_pending_at": oldest,
+            "last_synced_at": last_synced,
+            "last_error": head[0] if head else None,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxWorker:
+    """Background thread that drains one outlet's queue through apply(entries).
+
+    transient holds the exception types that mean "try again later", also
+    when they arrive wrapped in another error; they are recorded as the
+    entry's last error but never count towards dead-lettering it.
+    """
+
+    def __init__(self, outbox, outlet, apply, batch_size=OUTBOX_BATCH_SIZE,
+                 retry_seconds=OUTBOX_RETRY_SECONDS, max_backoff=OUTBOX_MAX_BACKOFF,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, transient=()):
+        self.outbox = outbox
+        self.outlet = outlet
+        self.apply = apply
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.transient = tuple(transient)
+        self.error = None
+        self._isolate = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def drain(self):
+        """Apply queued entries until the queue is empty. Returns how many were synced."""
+        synced = 0
+        while True:
+            entries = self.outbox.pending(self.outlet, limit=1 if self._isolate else self.batch_size)
+            if not entries:
+                return synced
+            keys = [key for key, _, _ in entries]
+            try:
+                self.apply(entries)
+            except Exception as error:
+                if self.is_transient(error):
+                    # Shown in the status line, but not counted towards dead-lettering
+                    self.outbox.mark_failed(keys, error, count=False)
+                    raise
+                attempts = self.outbox.mark_failed(keys, error)
+                if len(entries) > 1:
+                    # Retry the head on its own to find the entry that fails
+                    self._isolate = True
+                    raise
+                if attempts < self.max_attempts:
+                    raise
+                self.outbox.mark_dead(keys)
+                continue
+            self.outbox.mark_synced(keys)
+            self._isolate = False
+            synced += len(entries)
+
+    def is_transient(self, error):
+        """Whether error, or the error it wraps (RetryError.cause, raise ... from), is transient."""
+        seen = set()
+        while error is not None and id(error) not in seen:
+            if isinstance(error, self.transient):
+                return True
+            seen.add(id(error))
+            error = getattr(error, "cause", None) or error.__cause__
+        return False
+
+    def _run(self):
+        backoff = self.retry_seconds
+        while not self._stop.is_set():
+            # Cleared before draining so a write queued meanwhile is not missed
+            self._wake.clear()
+            try:
+                self.drain()
+                self.error = None
+                backoff = self.retry_seconds
+                # Sleep until something is queued; the timeout also picks up
+                # entries left by an earlier process
+                self._wake.wait(self.max_backoff)
+            except Exception as error:
+                # Offline or conflicting; keep the entries and try again later.
+                # New writes do not cut the backoff short.
+                self.error = error
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def notify(self):
+        """Wake the worker after queuing a write."""
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"outbox-{self.outlet}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
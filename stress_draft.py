@@ -0,0 +1,133 @@
+"""Contention stress test for DraftManager.
+
+Runs many concurrent writers that add and remove items on the shared draft
+through DraftManager, backed by an offline store from docstore.py, and
+checks afterwards that no write was lost, duplicated or applied to the
+wrong item. A writer thread that dies on an unexpected error, or a run
+that writes nothing at all, also fails the check.
+
+Run: python stress_draft.py --writers 16 --rounds 20 [--backend sqlite]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+# The module-level client must never reach Firebase from here
+os.environ["ORDERFLOW_STORAGE"] = "memory"
+
+from app import DraftConflictError, DraftManager  # noqa: E402
+from docstore import create_store  # noqa: E402
+
+
+def writer(manager, writer_id, rounds, batch_size, results, errors, lock):
+    try:
+        outcome = write_rounds(manager, writer_id, rounds, batch_size)
+    except Exception:
+        with lock:
+            errors.append(f"writer-{writer_id}: {traceback.format_exc()}")
+        return
+    with lock:
+        results.append(outcome)
+
+
+def write_rounds(manager, writer_id, rounds, batch_size):
+    added = set()
+    removed = set()
+    conflicts = 0
+
+    for round_number in range(rounds):
+        names = [f"w{writer_id}-r{round_number}-i{i}" for i in range(batch_size)]
+        try:
+            manager.add_items([(name, "1") for name in names], f"writer-{writer_id}")
+            added.update(names)
+        except DraftConflictError:
+            conflicts += 1
+
+        # Every other round, delete one of our own items by its stable ID
+        if round_number % 2 == 1 and added - removed:
+            target = sorted(added - removed)[0]
+            items = manager.get_draft().get('items', [])
+            item_id = next((item['id'] for item in items if item['name'] == target), None)
+            try:
+                result = manager.remove_item(item_id)
+                if result is not None:
+                    if result['name'] != target:
+                        raise AssertionError(f"Removed {result['name']} instead of {target}")
+                    removed.add(target)
+            except DraftConflictError:
+                conflicts += 1
+
+    return added, removed, conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=3)
+    parser.add_argument("--storage-mode", choices=["array", "subcollection"], default="array")
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        client = create_store(args.backend, os.path.join(workdir, "stress.db"))
+        try:
+            return run(client, args)
+        finally:
+            client.close()
+
+
+def run(client, args):
+    manager = DraftManager(client=client, storage_mode=args.storage_mode)
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    threads = [
+        threading.Thread(target=writer, args=(manager, i, args.rounds, args.batch_size, results, errors, lock))
+        for i in range(args.writers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    expected = set()
+    conflicts = 0
+    for added, removed, writer_conflicts in results:
+        expected |= added - removed
+        conflicts += writer_conflicts
+
+    draft = manager.get_draft()
+    names = [item['name'] for item in draft.get('items', [])]
+    # Subcollection drafts keep a separate counter that must agree with the items
+    counter_drift = draft.get('item_count', len(names)) - len(names)
+    duplicates = len(names) - len(set(names))
+    lost = expected - set(names)
+    unexpected = set(names) - expected
+
+    print(f"writers={args.writers} rounds={args.rounds} elapsed={elapsed:.2f}s")
+    print(f"items={len(names)} expected={len(expected)} gave_up={conflicts}")
+    print(f"store reads={client.reads} writes={client.writes}")
+    print(f"lost={len(lost)} unexpected={len(unexpected)} duplicates={duplicates} counter_drift={counter_drift}")
+    print(f"writer_errors={len(errors)}")
+    for error in errors:
+        print(error)
+
+    # Every writer failing, or giving up on every write, must not read as a pass
+    if errors or not expected or lost or unexpected or duplicates or counter_drift:
+        print("FAILED")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())